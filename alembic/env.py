@@ -13,6 +13,7 @@ sys.path.append(str(Path(__file__).resolve().parent.parent / 'src'))  # FIXME
 
 from configurations import CONFIG
 from database import BaseModel
+from database.partitions import PARTITION_NAME
 
 # configurations:
 config = context.config
@@ -26,6 +27,11 @@ if config.config_file_name is not None:
 target_metadata = BaseModel.metadata
 
 
+def include_name(name: str | None, type_: str, parent_names: dict) -> bool:
+    # history partitions are managed at runtime (see `database.partitions`)
+    return not (type_ == 'table' and name and PARTITION_NAME.match(name))
+
+
 def run_migrations_offline() -> None:
     """Run migrations in 'offline' mode.
 
@@ -44,6 +50,7 @@ def run_migrations_offline() -> None:
         target_metadata=target_metadata,
         literal_binds=True,
         dialect_opts={"paramstyle": "named"},
+        include_name=include_name,
     )
 
     with context.begin_transaction():
@@ -51,7 +58,7 @@ def run_migrations_offline() -> None:
 
 
 def do_run_migrations(connection: Connection) -> None:
-    context.configure(connection=connection, target_metadata=target_metadata)
+    context.configure(connection=connection, target_metadata=target_metadata, include_name=include_name)
 
     with context.begin_transaction():
         context.run_migrations()
@@ -0,0 +1,49 @@
+"""media counter
+
+Revision ID: da9e1a92c030
+Revises: 6e4e34672fd8
+Create Date: 2026-10-18 13:04:54.706426
+
+"""
+import sqlalchemy as sa
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = 'da9e1a92c030'
+down_revision = '6e4e34672fd8'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'media_counter',
+        sa.Column('storage_id', sa.BIGINT(), nullable=False),
+        sa.Column('media_type', sa.VARCHAR(length=256), nullable=False),
+        sa.Column('count', sa.BIGINT(), nullable=False),
+        sa.Column('id', sa.BIGINT(), nullable=False),
+        sa.Column('created_at', sa.DateTime(), server_default=sa.text('now()'), nullable=False),
+        sa.Column('updated_at', sa.DateTime(), server_default=sa.text('now()'), nullable=True),
+        sa.ForeignKeyConstraint(
+            ['storage_id'],
+            ['storage.id'],
+        ),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('storage_id', 'media_type'),
+    )
+
+    # backfill counters for existing history:
+    op.execute(
+        '''
+        INSERT INTO media_counter (storage_id, media_type, count)
+        SELECT "user".storage_id, message.media_type, count(*)
+        FROM message JOIN "user" ON "user".id = message.user_id
+        WHERE message.media_id IS NOT NULL AND message.media_type IS NOT NULL
+        GROUP BY "user".storage_id, message.media_type
+        '''
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('media_counter')
@@ -0,0 +1,63 @@
+"""media seq
+
+Revision ID: 42a14f3faa1c
+Revises: da9e1a92c030
+Create Date: 2026-10-18 13:07:05.265998
+
+"""
+import sqlalchemy as sa
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = '42a14f3faa1c'
+down_revision = 'da9e1a92c030'
+branch_labels = None
+depends_on = None
+
+BATCH_SIZE = 500
+"""Amount of storages which media is renumbered at once. """
+
+RENUMBER_MEDIA = sa.text(
+    '''
+    UPDATE message SET media_seq = ranked.seq
+    FROM (
+        SELECT
+            message.id,
+            row_number() OVER (PARTITION BY "user".storage_id, message.media_type ORDER BY message.id) - 1 AS seq
+        FROM message JOIN "user" ON "user".id = message.user_id
+        WHERE "user".storage_id IN :storage_ids AND message.media_id IS NOT NULL AND message.media_type IS NOT NULL
+    ) AS ranked
+    WHERE message.id = ranked.id
+    '''
+).bindparams(sa.bindparam('storage_ids', expanding=True))
+
+RECOUNT_MEDIA = sa.text(
+    '''
+    INSERT INTO media_counter (storage_id, media_type, count)
+    SELECT "user".storage_id, message.media_type, count(*)
+    FROM message JOIN "user" ON "user".id = message.user_id
+    WHERE "user".storage_id IN :storage_ids AND message.media_id IS NOT NULL AND message.media_type IS NOT NULL
+    GROUP BY "user".storage_id, message.media_type
+    ON CONFLICT (storage_id, media_type) DO UPDATE SET count = excluded.count, updated_at = now()
+    '''
+).bindparams(sa.bindparam('storage_ids', expanding=True))
+
+
+def upgrade() -> None:
+    op.add_column('message', sa.Column('media_seq', sa.BIGINT(), nullable=True))
+    op.create_index('ix_message_media_seq', 'message', ['user_id', 'media_type', 'media_seq'], unique=False)
+
+    # backfill media positions by storages batches, every batch is committed separately:
+    with op.get_context().autocommit_block():
+        connection = op.get_bind()
+        storage_ids = connection.execute(sa.text('SELECT id FROM storage ORDER BY id')).scalars().all()
+        for start in range(0, len(storage_ids), BATCH_SIZE):
+            batch = storage_ids[start : start + BATCH_SIZE]
+            connection.execute(RENUMBER_MEDIA, {'storage_ids': batch})
+            connection.execute(RECOUNT_MEDIA, {'storage_ids': batch})
+
+
+def downgrade() -> None:
+    op.drop_index('ix_message_media_seq', table_name='message')
+    op.drop_column('message', 'media_seq')
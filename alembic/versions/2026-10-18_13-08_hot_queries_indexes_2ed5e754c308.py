@@ -0,0 +1,60 @@
+"""hot queries indexes
+
+Revision ID: 2ed5e754c308
+Revises: 42a14f3faa1c
+Create Date: 2026-10-18 13:08:06.325401
+
+"""
+import sqlalchemy as sa
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = '2ed5e754c308'
+down_revision = '42a14f3faa1c'
+branch_labels = None
+depends_on = None
+
+
+# NOTE
+# Indexes are built CONCURRENTLY to not lock tables for writes while building. It could not be done inside transaction,
+# so every statement is committed separately.
+
+
+def upgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'ix_message_media',
+            'message',
+            ['user_id', 'media_type', 'media_seq'],
+            unique=False,
+            postgresql_where=sa.text('media_id IS NOT NULL'),
+            postgresql_concurrently=True,
+        )
+        op.drop_index('ix_message_media_seq', table_name='message', postgresql_concurrently=True)
+        op.create_index(
+            'ix_message_user_id_media_group_id',
+            'message',
+            ['user_id', 'media_group_id'],
+            unique=False,
+            postgresql_concurrently=True,
+        )
+        op.create_index('ix_user_storage_id', 'user', ['storage_id'], unique=False, postgresql_concurrently=True)
+        op.create_index(
+            'ix_user_storage_request_id', 'user', ['storage_request_id'], unique=False, postgresql_concurrently=True
+        )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_user_storage_request_id', table_name='user', postgresql_concurrently=True)
+        op.drop_index('ix_user_storage_id', table_name='user', postgresql_concurrently=True)
+        op.drop_index('ix_message_user_id_media_group_id', table_name='message', postgresql_concurrently=True)
+        op.create_index(
+            'ix_message_media_seq',
+            'message',
+            ['user_id', 'media_type', 'media_seq'],
+            unique=False,
+            postgresql_concurrently=True,
+        )
+        op.drop_index('ix_message_media', table_name='message', postgresql_concurrently=True)
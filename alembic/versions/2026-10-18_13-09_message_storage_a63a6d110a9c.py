@@ -0,0 +1,71 @@
+"""message storage
+
+Revision ID: a63a6d110a9c
+Revises: 2ed5e754c308
+Create Date: 2026-10-18 13:09:03.080284
+
+"""
+import sqlalchemy as sa
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = 'a63a6d110a9c'
+down_revision = '2ed5e754c308'
+branch_labels = None
+depends_on = None
+
+BATCH_SIZE = 10_000
+"""Amount of messages updated at once. """
+
+BACKFILL_STORAGE = sa.text(
+    '''
+    UPDATE message SET storage_id = "user".storage_id
+    FROM "user"
+    WHERE "user".id = message.user_id AND message.id >= :start AND message.id < :end AND message.storage_id IS NULL
+    '''
+)
+
+
+def upgrade() -> None:
+    op.add_column('message', sa.Column('storage_id', sa.BIGINT(), nullable=True))
+
+    # backfill by messages batches, every batch is committed separately:
+    with op.get_context().autocommit_block():
+        connection = op.get_bind()
+        start, end = connection.execute(sa.text('SELECT coalesce(min(id), 0), coalesce(max(id), 0) FROM message')).one()
+        for batch_start in range(start, end + 1, BATCH_SIZE):
+            connection.execute(BACKFILL_STORAGE, {'start': batch_start, 'end': batch_start + BATCH_SIZE})
+
+    # messages appended while backfilling, writes are locked until the column is set not null:
+    op.execute('LOCK TABLE message IN EXCLUSIVE MODE')
+    op.execute(BACKFILL_STORAGE.bindparams(start=0, end=2**63 - 1))
+    op.alter_column('message', 'storage_id', nullable=False)
+    op.create_foreign_key('message_storage_id_fkey', 'message', 'storage', ['storage_id'], ['id'])
+
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'ix_message_storage_media',
+            'message',
+            ['storage_id', 'media_type', 'media_seq'],
+            unique=False,
+            postgresql_where=sa.text('media_id IS NOT NULL'),
+            postgresql_concurrently=True,
+        )
+        op.drop_index('ix_message_media', table_name='message', postgresql_concurrently=True)
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'ix_message_media',
+            'message',
+            ['user_id', 'media_type', 'media_seq'],
+            unique=False,
+            postgresql_where=sa.text('media_id IS NOT NULL'),
+            postgresql_concurrently=True,
+        )
+        op.drop_index('ix_message_storage_media', table_name='message', postgresql_concurrently=True)
+
+    op.drop_constraint('message_storage_id_fkey', 'message', type_='foreignkey')
+    op.drop_column('message', 'storage_id')
@@ -0,0 +1,52 @@
+"""message chat
+
+Revision ID: 7bb19a0e58b8
+Revises: a63a6d110a9c
+Create Date: 2026-10-18 13:27:41.551418
+
+"""
+import sqlalchemy as sa
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = '7bb19a0e58b8'
+down_revision = 'a63a6d110a9c'
+branch_labels = None
+depends_on = None
+
+BATCH_SIZE = 10_000
+"""Amount of messages updated at once. """
+
+BACKFILL_CHAT = sa.text(
+    '''
+    UPDATE message SET chat_id = (json -> 'chat' ->> 'id')::bigint
+    WHERE message.id >= :start AND message.id < :end AND message.chat_id IS NULL
+    '''
+)
+
+
+def upgrade() -> None:
+    op.add_column('message', sa.Column('chat_id', sa.BIGINT(), nullable=True))
+
+    # backfill by messages batches, every batch is committed separately:
+    with op.get_context().autocommit_block():
+        connection = op.get_bind()
+        start, end = connection.execute(sa.text('SELECT coalesce(min(id), 0), coalesce(max(id), 0) FROM message')).one()
+        for batch_start in range(start, end + 1, BATCH_SIZE):
+            connection.execute(BACKFILL_CHAT, {'start': batch_start, 'end': batch_start + BATCH_SIZE})
+
+        op.create_index(
+            'ix_message_chat_id_message_id',
+            'message',
+            ['chat_id', 'message_id'],
+            unique=False,
+            postgresql_concurrently=True,
+        )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_message_chat_id_message_id', table_name='message', postgresql_concurrently=True)
+
+    op.drop_column('message', 'chat_id')
@@ -0,0 +1,85 @@
+"""message payload
+
+Revision ID: b4170a68585b
+Revises: 7bb19a0e58b8
+Create Date: 2026-10-18 13:34:31.641884
+
+"""
+import json
+import zlib
+
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = 'b4170a68585b'
+down_revision = '7bb19a0e58b8'
+branch_labels = None
+depends_on = None
+
+BATCH_SIZE = 10_000
+"""Amount of messages moved at once. """
+
+MOVE_PAYLOAD = sa.text(
+    '''
+    INSERT INTO message_payload (id, json)
+    SELECT id, json::jsonb FROM message
+    WHERE message.id >= :start AND message.id < :end
+    ON CONFLICT (id) DO NOTHING
+    '''
+)
+RESTORE_PAYLOAD = sa.text('UPDATE message SET json = CAST(:json AS json) WHERE id = :id')
+
+
+def upgrade() -> None:
+    op.create_table(
+        'message_payload',
+        sa.Column('id', sa.BIGINT(), nullable=False),
+        sa.Column('json', postgresql.JSONB(astext_type=sa.Text()), nullable=True),
+        sa.Column('compressed', sa.LargeBinary(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), server_default=sa.text('now()'), nullable=False),
+        sa.Column('updated_at', sa.DateTime(), server_default=sa.text('now()'), nullable=True),
+        sa.ForeignKeyConstraint(['id'], ['message.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('id'),
+    )
+
+    # move by messages batches, every batch is committed separately:
+    with op.get_context().autocommit_block():
+        connection = op.get_bind()
+        start, end = connection.execute(sa.text('SELECT coalesce(min(id), 0), coalesce(max(id), 0) FROM message')).one()
+        for batch_start in range(start, end + 1, BATCH_SIZE):
+            connection.execute(MOVE_PAYLOAD, {'start': batch_start, 'end': batch_start + BATCH_SIZE})
+
+    # messages appended while moving, writes are locked until the column is dropped:
+    op.execute('LOCK TABLE message IN EXCLUSIVE MODE')
+    op.execute(MOVE_PAYLOAD.bindparams(start=end + 1, end=2**63 - 1))
+    op.drop_column('message', 'json')
+
+
+def downgrade() -> None:
+    op.add_column('message', sa.Column('json', postgresql.JSON(astext_type=sa.Text()), nullable=True))
+
+    # compressed payloads are decoded here, so restore by batches at python side:
+    with op.get_context().autocommit_block():
+        connection = op.get_bind()
+        last_id = 0
+        while True:
+            query = sa.text(
+                'SELECT id, json, compressed FROM message_payload WHERE id > :last_id ORDER BY id LIMIT :limit'
+            )
+            payloads = connection.execute(query, {'last_id': last_id, 'limit': BATCH_SIZE}).all()
+            if not payloads:
+                break
+
+            values = [
+                {'id': id, 'json': zlib.decompress(compressed).decode() if compressed else json.dumps(data)}
+                for id, data, compressed in payloads
+            ]
+            connection.execute(RESTORE_PAYLOAD, values)
+            last_id = payloads[-1].id
+
+    op.execute("UPDATE message SET json = '{}' WHERE json IS NULL")
+    op.alter_column('message', 'json', nullable=False)
+    op.drop_table('message_payload')
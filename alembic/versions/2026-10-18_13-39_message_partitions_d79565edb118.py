@@ -0,0 +1,147 @@
+"""message partitions
+
+Revision ID: d79565edb118
+Revises: b4170a68585b
+Create Date: 2026-10-18 13:39:27.628623
+
+"""
+from datetime import date, datetime
+
+import sqlalchemy as sa
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = 'd79565edb118'
+down_revision = 'b4170a68585b'
+branch_labels = None
+depends_on = None
+
+BATCH_SIZE = 10_000
+"""Amount of messages copied at once. """
+MONTHS_AHEAD = 2
+
+COLUMNS = (
+    'id, created_at, updated_at, user_id, storage_id, chat_id, message_id, media_id, media_type, media_group_id, '
+    'media_seq'
+)
+INDEXES = ('ix_message_storage_media', 'ix_message_user_id_media_group_id', 'ix_message_chat_id_message_id')
+
+
+def upgrade() -> None:
+    op.drop_constraint('message_payload_id_fkey', 'message_payload', type_='foreignkey')
+
+    # indexes names are taken by partitioned table, which replaces existing one:
+    _rename_indexes('message', 'message_unpartitioned')
+    _create_table(
+        'message_partitioned',
+        sa.Column('is_media', sa.Boolean(), nullable=False),
+        sa.PrimaryKeyConstraint('id', 'created_at', 'is_media', name='message_pkey'),
+        postgresql_partition_by='RANGE (created_at)',
+    )
+    op.execute('CREATE TABLE message_default PARTITION OF message_partitioned DEFAULT')
+
+    connection = op.get_bind()
+    start = connection.execute(sa.text('SELECT min(created_at) FROM message')).scalar() or datetime.utcnow()
+    month = start.date().replace(day=1)
+    last_month = _add_months(datetime.utcnow().date().replace(day=1), MONTHS_AHEAD)
+    while month <= last_month:
+        name = f'message_y{month.year:04}m{month.month:02}'
+        op.execute(
+            f'''
+            CREATE TABLE {name} PARTITION OF message_partitioned
+            FOR VALUES FROM ('{month}') TO ('{_add_months(month, 1)}') PARTITION BY LIST (is_media)
+            '''
+        )
+        op.execute(f'CREATE TABLE {name}_media PARTITION OF {name} FOR VALUES IN (true)')
+        op.execute(f'CREATE TABLE {name}_text PARTITION OF {name} FOR VALUES IN (false)')
+        month = _add_months(month, 1)
+
+    _copy_messages('message', 'message_partitioned', f'{COLUMNS}, is_media', f'{COLUMNS}, media_id IS NOT NULL')
+    op.drop_table('message')
+    op.rename_table('message_partitioned', 'message')
+    op.execute('ALTER SEQUENCE message_id_seq OWNED BY message.id')
+
+
+def downgrade() -> None:
+    # NOTE: detached partitions (archived history) are not restored
+    _rename_indexes('message', 'message_partitioned')
+    _create_table('message_unpartitioned', sa.PrimaryKeyConstraint('id', name='message_pkey'))
+
+    _copy_messages('message', 'message_unpartitioned', COLUMNS, COLUMNS)
+    op.drop_table('message')  # partitions are dropped along
+    op.rename_table('message_unpartitioned', 'message')
+    op.execute('ALTER SEQUENCE message_id_seq OWNED BY message.id')
+
+    op.execute(
+        'DELETE FROM message_payload WHERE NOT EXISTS (SELECT FROM message WHERE message.id = message_payload.id)'
+    )
+    op.create_foreign_key('message_payload_id_fkey', 'message_payload', 'message', ['id'], ['id'], ondelete='CASCADE')
+
+
+def _add_months(month: date, amount: int) -> date:
+    index = month.year * 12 + month.month - 1 + amount
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def _rename_indexes(table: str, prefix: str):
+    op.execute(f'ALTER INDEX {table}_pkey RENAME TO {prefix}_pkey')
+    for index in INDEXES:
+        op.execute(f'ALTER INDEX {index} RENAME TO {index.replace("ix_message", f"ix_{prefix}")}')
+
+
+def _create_table(name: str, *elements: sa.schema.SchemaItem, **kwargs):
+    op.create_table(
+        name,
+        sa.Column('id', sa.BIGINT(), server_default=sa.text("nextval('message_id_seq'::regclass)"), nullable=False),
+        sa.Column('created_at', sa.DateTime(), server_default=sa.text('now()'), nullable=False),
+        sa.Column('updated_at', sa.DateTime(), server_default=sa.text('now()'), nullable=True),
+        sa.Column('user_id', sa.BIGINT(), nullable=False),
+        sa.Column('storage_id', sa.BIGINT(), nullable=False),
+        sa.Column('chat_id', sa.BIGINT(), nullable=True),
+        sa.Column('message_id', sa.BIGINT(), nullable=False),
+        sa.Column('media_id', sa.String(), nullable=True),
+        sa.Column('media_type', sa.VARCHAR(length=256), nullable=True),
+        sa.Column('media_group_id', sa.String(), nullable=True),
+        sa.Column('media_seq', sa.BIGINT(), nullable=True),
+        *elements,
+        sa.ForeignKeyConstraint(['storage_id'], ['storage.id'], name='message_storage_id_fkey'),
+        sa.ForeignKeyConstraint(['user_id'], ['user.id'], name='message_user_id_fkey'),
+        **kwargs,
+    )
+    op.create_index(
+        'ix_message_storage_media',
+        name,
+        ['storage_id', 'media_type', 'media_seq'],
+        postgresql_where=sa.text('media_id IS NOT NULL'),
+    )
+    op.create_index('ix_message_user_id_media_group_id', name, ['user_id', 'media_group_id'])
+    op.create_index('ix_message_chat_id_message_id', name, ['chat_id', 'message_id'])
+
+
+def _copy_messages(source: str, target: str, columns: str, values: str):
+    """
+    Copy by messages batches, every batch is committed separately. Then, with source table locked, copy messages
+    written or updated meanwhile.
+    """
+    copy = f'INSERT INTO {target} ({columns}) SELECT {values} FROM {source}'
+    with op.get_context().autocommit_block():
+        connection = op.get_bind()
+        started = connection.execute(sa.text('SELECT clock_timestamp()')).scalar()
+        start, end = connection.execute(
+            sa.text(f'SELECT coalesce(min(id), 0), coalesce(max(id), 0) FROM {source}')
+        ).one()
+        for batch_start in range(start, end + 1, BATCH_SIZE):
+            connection.execute(
+                sa.text(f'{copy} WHERE id >= :start AND id < :end'),
+                {'start': batch_start, 'end': min(batch_start + BATCH_SIZE, end + 1)},
+            )
+
+    op.execute(f'LOCK TABLE {source} IN EXCLUSIVE MODE')
+    op.execute(
+        sa.text(f'DELETE FROM {target} WHERE id IN (SELECT id FROM {source} WHERE updated_at >= :started)').bindparams(
+            started=started
+        )
+    )
+    op.execute(sa.text(f'{copy} WHERE id > :end OR updated_at >= :started').bindparams(end=end, started=started))
+    op.execute('ALTER SEQUENCE message_id_seq OWNED BY NONE')
@@ -4,8 +4,16 @@ Different helpfull tools.
 
 
 from enum import Enum
+from typing import Literal
 
 
 class MediaType(Enum):
     photo = 'photo'
     video = 'video'
+
+
+PayloadCodec = Literal['jsonb', 'zlib']
+"""
+How raw messages are stored (see `MessagePayloadModel`): as JSONB (compressed by Postgres TOAST) or as zlib compressed
+JSON bytes.
+"""
@@ -1,3 +1,21 @@
-from .application import app, builder
+from typing import TYPE_CHECKING
 
-__all__ = ['app', 'builder']
+if TYPE_CHECKING:
+    from .application import LayeredApplication, app, builder
+
+__all__ = ['app', 'builder', 'get_app']
+
+
+def get_app() -> 'LayeredApplication':
+    from .application import get_app
+
+    return get_app()
+
+
+def __getattr__(name: str):
+    # application (and all its dependencies) is imported at first access
+    if name in ('app', 'builder'):
+        from . import application
+
+        return getattr(application, name)
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
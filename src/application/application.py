@@ -1,11 +1,11 @@
+from datetime import datetime, timedelta, timezone
+from functools import cache
 from types import NoneType
 
-from apscheduler.schedulers.asyncio import AsyncIOScheduler
-from telegram.ext import ContextTypes
+from telegram.ext import ApplicationBuilder, ContextTypes
 
 from application.base import LayeredApplication
 from application.context import CustomContext
-from application.handlers import handler
 from application.middlewares import (
     args_middleware,
     history_middleware,
@@ -13,11 +13,18 @@ from application.middlewares import (
     session_middleware,
     user_middleware,
 )
-from application.tasks import send_feed_me_message_task
+from application.ratelimiter import OutboundRateLimiter
+from application.scheduler import JobScheduler
+from application.tasks import (
+    maintain_history_partitions_task,
+    send_subscriptions_task,
+)
 from configurations import CONFIG, logger
 
 
 async def app_init(app: LayeredApplication):
+    from application.handlers import handler  # content is loaded for handlers filters
+
     logger.info('App post init. ')
     app.add_middlewares(
         [
@@ -28,13 +35,38 @@ async def app_init(app: LayeredApplication):
             args_middleware,
         ]
     )
-    app.add_handlers(list(handler.values()))  # FIXME
+    app.add_handlers(handler)
     # app.add_error_handler(error_handler) # UNUSED
 
-    # register bg task
-    scheduler = AsyncIOScheduler()
-    for cron in CONFIG.send_feed_me_message_crons:
-        scheduler.add_job(send_feed_me_message_task, cron)
+
+def get_job_scheduler(app: LayeredApplication) -> JobScheduler:
+    """
+    Cron jobs executed once by all running instances (subscriptions sending, history maintenance). Ticked by scheduler
+    at polling mode and by invocations at webhook mode (see `webhook.tick_jobs`).
+    """
+    jobs = JobScheduler(
+        app.engine,
+        recovery_window=timedelta(seconds=CONFIG.scheduler_recovery_window),
+        lease=timedelta(seconds=CONFIG.scheduler_job_lease),
+    )
+    jobs.add_job(maintain_history_partitions_task, CONFIG.history_maintenance_cron)
+    jobs.add_job(send_subscriptions_task, CONFIG.send_subscriptions_cron)
+    return jobs
+
+
+async def polling_init(app: LayeredApplication):
+    await app_init(app)
+
+    # register bg task (useless for webhook, as function is not running between updates)
+    from apscheduler.schedulers.asyncio import AsyncIOScheduler
+    from apscheduler.triggers.interval import IntervalTrigger
+
+    # missed runs are executed at start up:
+    scheduler = AsyncIOScheduler(timezone='UTC')
+    jobs = get_job_scheduler(app)
+    scheduler.add_job(
+        jobs.tick, IntervalTrigger(seconds=CONFIG.scheduler_interval), next_run_time=datetime.now(timezone.utc)
+    )
 
     scheduler.start()
 
@@ -46,15 +78,40 @@ NoneContextType = ContextTypes(  # in-memory data is deprecated for this applica
     context=CustomContext,
 )
 
-# TODO create appbuilder object, but do not create app
-builder = (
-    LayeredApplication.builder()
-    .token(CONFIG.bot_token.get_secret_value())
-    .context_types(NoneContextType)
-    .application_class(LayeredApplication)
-    .post_init(app_init)
-)
-app: LayeredApplication = builder.build()
+
+@cache
+def get_builder() -> ApplicationBuilder:
+    return (
+        LayeredApplication.builder()
+        .token(CONFIG.bot_token.get_secret_value())
+        .context_types(NoneContextType)
+        .application_class(LayeredApplication)
+        .concurrent_updates(CONFIG.update_pending_max)
+        .job_queue(None)  # tasks are scheduled by application itself
+        .rate_limiter(
+            OutboundRateLimiter(
+                rate=CONFIG.outbound_rate,
+                chat_rate=CONFIG.outbound_chat_rate,
+                chat_burst=CONFIG.outbound_chat_burst,
+                max_retries=CONFIG.outbound_max_retries,
+            )
+        )
+        .post_init(app_init)
+    )
+
+
+@cache
+def get_app() -> LayeredApplication:
+    return get_builder().build()  # type: ignore[return-value]
+
+
+def __getattr__(name: str):
+    # lazy module level singletons, application is built at first access
+    if name == 'app':
+        return get_app()
+    if name == 'builder':
+        return get_builder()
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
 
 
 async def error_handler(update: object, context: CustomContext) -> None:
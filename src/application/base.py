@@ -1,7 +1,10 @@
-from contextlib import AsyncContextDecorator
-from typing import Callable, TypeAlias
+import asyncio
+import inspect
+from functools import partial
+from typing import Callable, Iterable, TypeAlias
 
-from telegram import Bot, Update
+from sqlalchemy.ext.asyncio import AsyncEngine
+from telegram import Bot, Message, Update
 from telegram.ext import (
     Application,
     BaseHandler,
@@ -14,7 +17,64 @@ from telegram.ext import (
 from telegram.ext import filters as telegram_filters
 
 from application.context import CustomContext
-from configurations import logger
+from application.middlewares import DEPENDENCIES_ARGUMENTS, Dependency, HandlerCallback
+from configurations import CONFIG, logger
+from database import HistoryWriter, MembershipCache, create_engine, warmup_engine
+
+
+def normalize_text(text: str):
+    return text.strip().casefold()
+
+
+class ExactTextFilter(telegram_filters.MessageFilter):
+    """
+    Message text equals (after normalization) to one of the texts. Checked by set lookup.
+    """
+
+    __slots__ = ('texts',)
+
+    def __init__(self, texts: Iterable[str], name: str | None = None):
+        self.texts = frozenset(normalize_text(text) for text in texts)
+        super().__init__(name=name or f'ExactTextFilter({len(self.texts)} texts)')
+
+    def filter(self, message: Message) -> bool:
+        return bool(message.text) and normalize_text(message.text) in self.texts
+
+
+class TextDispatchHandler(BaseHandler[Update, CustomContext]):
+    """
+    Dispatch text messages to handlers by their exact (normalized) text with a single dict lookup, instead of checking
+    handlers filters one by one. Added by `LayeredApplication` in front of the first indexed handler.
+
+    Found handler is checked and handled as usual (its filters, `block`, additional context). Handlers of conversations
+    could not be indexed, as conversation state is bypassed by dispatching.
+    """
+
+    __slots__ = ('index',)
+
+    def __init__(self, index: dict[str, BaseHandler]):
+        super().__init__(callback=self.handle_update)  # not called, update is handled by indexed handler
+        self.index = index
+
+    def check_update(self, update: object):
+        if not isinstance(update, Update) or not update.message or not update.message.text:
+            return None
+        handler = self.index.get(normalize_text(update.message.text))
+        if handler is None:
+            return None
+
+        check = handler.check_update(update)
+        if check is None or check is False:
+            return None
+        return handler, check
+
+    async def handle_update(self, update: Update, application: Application, check_result, context: CustomContext):
+        handler, check = check_result
+        coroutine = handler.handle_update(update, application, check, context)
+        if not handler.block:
+            application.create_task(coroutine, update=update)
+            return None
+        return await coroutine
 
 
 class APPHandlers(dict[str, BaseHandler]):
@@ -24,9 +84,17 @@ class APPHandlers(dict[str, BaseHandler]):
     Docs: https://github.com/python-telegram-bot/python-telegram-bot/wiki/Code-snippets#advanced-snippets
     """
 
+    def __init__(self) -> None:
+        super().__init__()
+        self.requirements: dict[Callable, Dependency] = {}
+        """Resources required by handler callbacks. Only middlewares providing them are called for the handler. """
+        self.texts: dict[str, BaseHandler] = {}
+        """Index of handlers by exact (normalized) message texts. """
+
     # TODO: type annotations
-    def command(self, command=None, filters=None, block=True):
+    def command(self, command=None, filters=None, block=True, requires: Dependency = Dependency.ALL):
         def callback(wrapped: Callable):
+            self.requirements[wrapped] = requires
             self.append(
                 CommandHandler(
                     callback=wrapped,
@@ -39,15 +107,25 @@ class APPHandlers(dict[str, BaseHandler]):
 
         return callback
 
-    def message(self, filters=None, block=True):
+    def message(self, filters=None, block=True, requires: Dependency = Dependency.ALL, texts: Iterable[str] = ()):
+        """
+        `texts`: exact messages texts handled by dispatch index lookup. Then `filters` are checked as usual.
+        """
+
         def callback(wrapped: Callable):
-            self.append(
-                MessageHandler(
-                    callback=wrapped,
-                    filters=filters or getattr(telegram_filters, wrapped.__name__.upper()),
-                    block=block,
-                )
-            )
+            self.requirements[wrapped] = requires
+
+            handler_filters = filters or getattr(telegram_filters, wrapped.__name__.upper())
+            if texts:
+                handler_filters = ExactTextFilter(texts) | filters if filters else ExactTextFilter(texts)
+
+            handler = MessageHandler(callback=wrapped, filters=handler_filters, block=block)
+            for text in map(normalize_text, texts):
+                if text in self.texts:
+                    raise ValueError(f'Text {text!r} is already handled by {self.texts[text].callback}. ')
+                self.texts[text] = handler
+
+            self.append(handler)
             return wrapped
 
         return callback
@@ -58,69 +136,219 @@ class APPHandlers(dict[str, BaseHandler]):
         self[handler_name] = handler
 
 
-MiddlewaresType: TypeAlias = list[Callable[[Update, CustomContext], AsyncContextDecorator]]
+MiddlewaresType: TypeAlias = list[Callable]
+
+
+def compile_middleware(middleware: Callable, call_next: HandlerCallback) -> HandlerCallback:
+    """
+    Bind middleware to the next layer once, so per update only compiled layers are called one after another.
+    """
+    if compile_ := getattr(middleware, 'compile', None):
+        return compile_(call_next)
+
+    if inspect.iscoroutinefunction(middleware):
+        return partial(middleware, call_next)
+
+    # legacy @asynccontextmanager middleware:
+    if inspect.isasyncgenfunction(getattr(middleware, '__wrapped__', None)):
+
+        async def context_manager_layer(update: Update, context: CustomContext):
+            async with middleware(update, context):
+                return await call_next(update, context)
+
+        return context_manager_layer
+
+    # legacy class-based middleware:
+    async def decorator_layer(update: Update, context: CustomContext):
+        return await middleware(update, context)(call_next)(update, context)
+
+    return decorator_layer
 
 
 # TODO rename to ???
 class LayeredApplication(Application[ExtBot[None], CustomContext, None, None, None, JobQueue]):
     _middlewares: MiddlewaresType = []
+    _engine: AsyncEngine | None = None
+    _lanes: tuple[asyncio.Lock, ...] = ()
+    _history_writer: HistoryWriter | None = None
+    _membership_cache: MembershipCache | None = None
+
+    @property
+    def engine(self) -> AsyncEngine:
+        """
+        Database engine shared between all updates. Connections are checked out from its pool per update.
+        """
+        if not self._engine:
+            raise RuntimeError('Database engine is not initialized. Initialize application before. ')
+        return self._engine
+
+    async def init_engine(self):
+        if self._engine:
+            raise RuntimeError('Database engine already initialized.')
+
+        self._engine = create_engine(CONFIG)
+        await warmup_engine(self._engine, min(CONFIG.db_pool_min_size, CONFIG.db_pool_size))
+        logger.info(f'Database engine initialized: {self._engine.pool.status()}')
+
+    @property
+    def history_writer(self) -> HistoryWriter | None:
+        """
+        Write-behind history recorder (if turned on by `CONFIG.history_writer`). Flushed at application stop.
+        """
+        return self._history_writer
+
+    @property
+    def membership_cache(self) -> MembershipCache | None:
+        """
+        Users with their storage membership (if turned on by `CONFIG.user_cache_size`). Shared by all updates.
+        """
+        return self._membership_cache
+
+    async def initialize(self) -> None:
+        await super().initialize()
+        await self.init_engine()
+        self._lanes = tuple(asyncio.Lock() for _ in range(CONFIG.update_lanes))
+
+        if CONFIG.user_cache_size:
+            self._membership_cache = MembershipCache(maxsize=CONFIG.user_cache_size, ttl=CONFIG.user_cache_ttl)
+        if CONFIG.history_writer:
+            self._history_writer = HistoryWriter(
+                self.engine,
+                batch_size=CONFIG.history_writer_batch_size,
+                flush_interval=CONFIG.history_writer_flush_interval,
+                max_pending=CONFIG.history_writer_max_pending,
+                max_retries=CONFIG.history_writer_max_retries,
+            )
+
+    async def start(self) -> None:
+        await super().start()
+        if self._history_writer:
+            self._history_writer.start()
+
+    async def stop(self) -> None:
+        await super().stop()
+        if self._history_writer:
+            await self._history_writer.stop()
+
+    async def process_update(self, update: object) -> None:
+        """
+        Updates are hashed by user onto serialized lanes. Updates of the same user are processed one after another in
+        the order they were received, while different lanes are processed concurrently (when `concurrent_updates` is
+        turned on).
+        """
+        self._check_initialized()
+        async with self._get_lane(update):
+            await super().process_update(update)
+
+    async def _Application__process_update_wrapper(self, update: object) -> None:  # noqa: N802
+        """
+        Overrides PTB (20.1) private wrapper of fetched updates, as it takes the global `concurrent_updates` slot
+        before `process_update`, so updates waiting for a busy lane would take slots of all other lanes. Lane is
+        waited here before the slot.
+        """
+        async with self._get_lane(update):
+            async with self._concurrent_updates_sem:
+                await super().process_update(update)
+        self.update_queue.task_done()
+
+    def _get_lane(self, update: object) -> asyncio.Lock:
+        key = 0
+        if isinstance(update, Update):
+            if update.effective_user:
+                key = update.effective_user.id
+            elif update.effective_chat:
+                key = update.effective_chat.id
+
+        return self._lanes[key % len(self._lanes)]
+
+    async def shutdown(self) -> None:
+        await super().shutdown()
+        if self._history_writer:
+            await self._history_writer.stop()  # in case application was not started
+            self._history_writer = None
+        if self._engine:
+            logger.info(f'Dispose database engine: {self._engine.pool.status()}')
+            await self._engine.dispose()
+            self._engine = None
 
     def add_middlewares(self, middlewares: MiddlewaresType):
         if self._middlewares:
             raise RuntimeError('Middlewares already set.')
+        if any(self.handlers.values()):
+            raise RuntimeError('Middlewares should be set before handlers, as they are compiled at registration.')
 
         self._middlewares = list(middlewares)
 
-    def add_handlers(self, handlers: dict | list, group: int = 0) -> None:  # type: ignore
-        if isinstance(handlers, dict):
+    def add_handlers(self, handlers: APPHandlers | list, group: int = 0) -> None:  # type: ignore
+        if isinstance(handlers, dict) and not isinstance(handlers, APPHandlers):
             raise NotImplementedError
 
+        requirements: dict[Callable, Dependency] = {}
+        texts: dict[str, BaseHandler] = {}
+        if isinstance(handlers, APPHandlers):
+            requirements = handlers.requirements
+            texts = handlers.texts
+            handlers = list(handlers.values())
+
         for handler in handlers:
             if isinstance(handler, ConversationHandler):
-                # FIXME
                 conversation_handler = handler
+                nested_handlers = [
+                    *conversation_handler._entry_points,
+                    *(state_handler for state in conversation_handler._states.values() for state_handler in state),
+                    *conversation_handler._fallbacks,
+                ]
+            else:
+                nested_handlers = [handler]
 
-                for entry_handler in conversation_handler._entry_points:
-                    logger.debug(f'[Add <{entry_handler.callback.__name__}> handler] ')
-                    entry_handler.callback = self._handler_callback_factory(entry_handler.callback)
-
-                for key, state_handlers in conversation_handler._states.items():
-                    for state_handler in state_handlers:
-                        logger.debug(f'[Add <{state_handler.callback.__name__}> handler] ')
-                        state_handler.callback = self._handler_callback_factory(state_handler.callback)
+            if isinstance(handler, ConversationHandler) and set(nested_handlers) & set(texts.values()):
+                raise ValueError('Conversation handlers could not be indexed by texts. ')
 
-                for fallback_handler in conversation_handler._fallbacks:
-                    logger.debug(f'[Add <{fallback_handler.callback.__name__}> handler] ')
-                    fallback_handler.callback = self._handler_callback_factory(fallback_handler.callback)
+            for nested_handler in nested_handlers:
+                requires = requirements.get(nested_handler.callback, Dependency.ALL)
+                logger.debug(f'[Add <{nested_handler.callback.__name__}> handler] Requires: {requires}. ')
+                nested_handler.callback = self._handler_callback_factory(nested_handler.callback, requires)
 
-            else:
-                handler.callback = self._handler_callback_factory(handler.callback)
+        if texts:
+            # handlers registered before the first indexed one keep their priority:
+            indexed = set(texts.values())
+            position = next(i for i, handler in enumerate(handlers) if handler in indexed)
+            handlers = [*handlers[:position], TextDispatchHandler(texts), *handlers[position:]]
 
         super().add_handlers(handlers)
 
-    def _handler_callback_factory(self, original_callback: Callable):
-        async def handler_caller(update, context):
-            logger.info(f'[Handler: <{original_callback.__name__}>] Handling update. ')
-
-            wrapped = self._wrap_into_middlewares(original_callback, update, context)
-            await wrapped(update, context)  # unwrap (call for) one layer after another
+    def _handler_callback_factory(self, original_callback: Callable, requires: Dependency = Dependency.ALL):
+        pipeline = self._compile_middlewares(original_callback, requires)
+        name = original_callback.__name__
 
-            logger.info(f'[Handler: <{original_callback.__name__}>] Done. ')
+        async def handler_caller(update: Update, context: CustomContext):
+            logger.info(f'[Handler: <{name}>] Handling update. ')
+            result = await pipeline(update, context)
+            logger.info(f'[Handler: <{name}>] Done. ')
+            return result
 
         return handler_caller
 
-    def _wrap_into_middlewares(self, original_callback: Callable, update, context):
+    def _compile_middlewares(self, original_callback: Callable, requires: Dependency) -> HandlerCallback:
         """
-        Wrap original_callback into middlewares.
+        Wrap original_callback into middlewares providing required resources once at registration.
         """
+        requires = requires.resolve()
+        for name in inspect.signature(original_callback).parameters:
+            dependency = DEPENDENCIES_ARGUMENTS.get(name)
+            if dependency and dependency not in requires:
+                raise ValueError(
+                    f'Invalid handler argument ({name}). {dependency} is not required by {original_callback}.'
+                )
+
         layer = original_callback  # variable alias to avoid Unbound error
 
-        # - all middlewares wrapped into @asynccontextmanager
-        # - @asynccontextmanager produce a decorator, which called with `layer` argument
-        # - reversed: the last layer added will be called first when `handler_caller` invokes unwrapping
+        # reversed: the last layer added will be called first when `handler_caller` invokes pipeline
         for middleware in reversed(self._middlewares):
-            middleware_decorator = middleware(update, context)
-            layer = middleware_decorator.__call__(layer)
+            provides = getattr(middleware, 'provides', None)
+            if provides is not None and not provides & requires:
+                continue
+            layer = compile_middleware(middleware, layer)
 
         return layer
 
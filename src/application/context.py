@@ -1,13 +1,27 @@
+from __future__ import annotations
+
+from typing import TYPE_CHECKING
+
 from sqlalchemy.ext.asyncio import AsyncSession
 from telegram.ext import CallbackContext, ExtBot
 
+from application.outbox import Outbox
 from database.models import UserModel
 from service import AppService
 
+if TYPE_CHECKING:
+    from application.base import LayeredApplication
+
 
 class CustomContext(CallbackContext[ExtBot, None, None, None]):
     session: AsyncSession  # TODO rename db_session
+    outbox: Outbox
+    """Outbound calls sent after session transaction is committed. """
     user: UserModel
     """Effective user from DB (accessing telegram object via `user.tg`). """
     service: AppService
     """Application service. """
+
+    @property
+    def application(self) -> LayeredApplication:
+        return super().application  # type: ignore[return-value]
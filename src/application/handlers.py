@@ -1,14 +1,17 @@
-import json
 import re
-from asyncio import sleep
+from pathlib import Path
+from tempfile import TemporaryDirectory
 
 from telegram import Bot, Message, ReplyKeyboardMarkup
 from telegram.ext import ConversationHandler, filters
 
 from application.base import APPHandlers, LayeredApplication
+from application.middlewares import Dependency
+from application.outbox import Outbox
 from configurations import CONFIG, logger
 from content import CONTENT
-from database.models import MessageModel, UserModel
+from database.models import UserModel
+from dumps import dump_history, load_history
 from exceptions import NoPhotosException, NoUserException
 from service import AppService
 
@@ -16,69 +19,104 @@ handler = APPHandlers()
 
 
 @handler.command()
-async def start(user: UserModel, message: Message):
-    await message.reply_text(
+async def start(user: UserModel, message: Message, outbox: Outbox):
+    outbox.add(
+        message.reply_text,
         text=CONTENT.messages.start.format(username=user.tg.username or ''),
         reply_markup=ReplyKeyboardMarkup(CONTENT.keyboard, resize_keyboard=True),
     )
 
 
 @handler.command()
-async def admin_loaddata(user: UserModel, message: Message, service: AppService, bot: Bot):
+async def admin_loaddata(
+    user: UserModel, message: Message, service: AppService, application: LayeredApplication, outbox: Outbox
+):
     if user.id != CONFIG.admin_id or not CONFIG.dump_filepath:
         return
 
-    with open(CONFIG.dump_filepath, 'r') as file:
-        messages = Message.de_list(json.load(file), bot)
+    summary = await load_history(application.engine, CONFIG.dump_filepath, user_id=user.id, storage_id=user.storage_id)
+    outbox.add(message.reply_text, text=f'{summary}Total: {(await service.get_media_count())}')
+
+
+@handler.command()
+async def admin_dumpdata(user: UserModel, message: Message, application: LayeredApplication, outbox: Outbox):
+    if user.id != CONFIG.admin_id:
+        return
+
+    if application.history_writer:
+        await application.history_writer.flush()
+
+    # removed when dump is sent (or when directory is garbage collected, if handler fails):
+    directory = TemporaryDirectory()
+    filepath = Path(directory.name) / f'history-{user.storage_id}.jsonl.gz'
+    amount = await dump_history(application.engine, filepath, storage_id=user.storage_id)
+
+    async def reply_dump():
+        try:
+            with filepath.open('rb') as document:
+                await message.reply_document(document, filename=filepath.name, caption=f'{amount} messages. ')
+        finally:
+            directory.cleanup()
+
+    outbox.add(reply_dump)
+
+
+@handler.command()
+async def count(user: UserModel, message: Message, service: AppService, outbox: Outbox):
+    outbox.add(message.reply_text, text=(await service.get_media_count()))
+
 
-    logger.info(f'upload {len(messages)} messages. ')
-    for message in messages:
-        service.append_history(message)
+@handler.command()
+async def subscribe(message: Message, service: AppService, outbox: Outbox, args: list):
+    try:
+        subscription = await service.subscribe(*args[:1])
+    except (KeyError, ValueError):
+        outbox.add(message.reply_text, CONTENT.messages.subscription.invalid_timezone)
+        return
 
-    logger.info(f'add to database. total: {(await service.get_media_count())}')
+    outbox.add(message.reply_text, CONTENT.messages.subscription.subscribe.format(timezone=subscription.timezone))
 
 
 @handler.command()
-async def count(user: UserModel, message: Message, service: AppService):
-    await message.reply_text(text=(await service.get_media_count()))
+async def unsubscribe(message: Message, service: AppService, outbox: Outbox):
+    await service.unsubscribe()
+    outbox.add(message.reply_text, CONTENT.messages.subscription.unsubscribe)
 
 
 @handler.message()
-async def photo(message: Message, service: AppService, user: UserModel):
+async def photo(message: Message, service: AppService, user: UserModel, outbox: Outbox):
     if (await service.get_media_count()) > 1:
         # [1] many photos received:
         # reply in case it first Update with that media group
         if message.media_group_id:
-            count = await service.get_history_count(MessageModel.media_group_id == message.media_group_id)
+            count = await service.get_media_group_count(message.media_group_id)
             if count <= 1:
-                await message.reply_text(text=CONTENT.messages.receive_photo.group.get())
+                outbox.add(message.reply_text, text=CONTENT.messages.receive_photo.group.get())
             return
 
         # [2] single photo received
-        await message.reply_text(text=CONTENT.messages.receive_photo.basic.get())
+        outbox.add(message.reply_text, text=CONTENT.messages.receive_photo.basic.get())
         return
 
     # [3] photo received in a first time
-    await message.reply_text(text=CONTENT.messages.receive_photo.initial.get())
+    outbox.add(message.reply_text, text=CONTENT.messages.receive_photo.initial.get())
 
 
-@handler.message(filters.Regex(r'|'.join(CONTENT.buttons)))
-async def emoji_food(message: Message, service: AppService):
-    await message.reply_text(CONTENT.messages.receive_food.get())
-    await sleep(0.5)
+@handler.message(filters.Regex(r'|'.join(map(re.escape, CONTENT.buttons))), texts=CONTENT.buttons)
+async def emoji_food(message: Message, service: AppService, outbox: Outbox):
+    outbox.add(message.reply_text, CONTENT.messages.receive_food.get())
+    outbox.pause(0.5)
 
     try:
         photo = await service.get_media_id()
     except NoPhotosException:
-        await message.reply_text(CONTENT.messages.exceptions.no_photos)
+        outbox.add(message.reply_text, CONTENT.messages.exceptions.no_photos)
     else:
-        await message.reply_photo(photo, CONTENT.messages.send_photo.any.get())
+        outbox.add(message.reply_photo, photo, CONTENT.messages.send_photo.any.get())
 
 
 @handler.message(filters.FORWARDED)
-async def family_start(
-    bot: Bot, message: Message, service: AppService, user: UserModel, application: LayeredApplication
-):
+async def family_start(bot: Bot, message: Message, service: AppService, user: UserModel, outbox: Outbox):
     """
     ### Add to family. Workflow.
 
@@ -88,22 +126,25 @@ async def family_start(
     """
 
     if not user.tg.username:
-        await message.reply_text(CONTENT.messages.exceptions.name_not_set)
+        outbox.add(message.reply_text, CONTENT.messages.exceptions.name_not_set)
         return ConversationHandler.END
 
     try:
         from_user = await service.get_user(message.forward_from)
     except NoUserException:
-        await message.reply_text(CONTENT.messages.exceptions.user_not_start_bot)
+        outbox.add(message.reply_text, CONTENT.messages.exceptions.user_not_start_bot)
         return ConversationHandler.END
 
     if user.storage == from_user.storage:
-        await message.reply_text(CONTENT.messages.exceptions.already_added_to_family)
+        outbox.add(message.reply_text, CONTENT.messages.exceptions.already_added_to_family)
         return ConversationHandler.END
 
     # NOTE: send an reqest for confirmation *NOT* to `from_user`, but to owner of the storage he is associated with
-    await bot.send_message(from_user.storage.id, CONTENT.messages.family.request.format(username=user.tg.username))
+    outbox.add(
+        bot.send_message, from_user.storage.id, CONTENT.messages.family.request.format(username=user.tg.username)
+    )
     user.storage_request = from_user.storage
+    service.invalidate_membership(user_ids=(user.id,), storage_ids=(from_user.storage.id,))
 
     # conversation routing
     family: ConversationHandler = handler['family']
@@ -115,8 +156,11 @@ async def family_start(
     return ConversationHandler.END
 
 
-@handler.message(filters.Regex(re.compile(r'|'.join(CONTENT.confirm_answers), re.IGNORECASE)))
-async def family_confirm(bot: Bot, message: Message, service: AppService, user: UserModel):
+# answers are not indexed by texts (see `TextDispatchHandler`), as they are handled at conversation state only
+@handler.message(
+    filters.Regex(re.compile(r'|'.join(map(re.escape, CONTENT.confirm_answers)), re.IGNORECASE)),
+)
+async def family_confirm(bot: Bot, message: Message, service: AppService, user: UserModel, outbox: Outbox):
     if not user.storage.requests:
         logger.error('No family requests. ')
         return
@@ -124,16 +168,23 @@ async def family_confirm(bot: Bot, message: Message, service: AppService, user:
         logger.warning('Many family requests: not implemented. Taking the last. ')  # TODO
 
     participant = user.storage.requests.pop()
-    user.storage.participants.append(participant)
+    previous_storage_id = participant.storage_id
+    participant.storage = user.storage
+    service.invalidate_membership(user_ids=(participant.id,), storage_ids=(previous_storage_id, user.storage.id))
+
+    # participant history is moved to another storage along with him:
+    await service.move_history(participant.id, previous_storage_id, user.storage.id)
 
-    await bot.send_message(participant.id, CONTENT.messages.family.confirm)
-    await message.reply_text(CONTENT.messages.family.confirm)
+    outbox.add(bot.send_message, participant.id, CONTENT.messages.family.confirm)
+    outbox.add(message.reply_text, CONTENT.messages.family.confirm)
 
     return ConversationHandler.END
 
 
-@handler.message(filters.Regex(re.compile(r'|'.join(CONTENT.reject_answers), re.IGNORECASE)))
-async def family_reject(bot: Bot, message: Message, service: AppService, user: UserModel):
+@handler.message(
+    filters.Regex(re.compile(r'|'.join(map(re.escape, CONTENT.reject_answers)), re.IGNORECASE)),
+)
+async def family_reject(bot: Bot, message: Message, service: AppService, user: UserModel, outbox: Outbox):
     if not user.storage.requests:
         logger.error('No family requests. ')
         return
@@ -141,12 +192,13 @@ async def family_reject(bot: Bot, message: Message, service: AppService, user: U
         logger.warning('Many family requests: not implemented. Taking the last. ')  # TODO
 
     participant = user.storage.requests.pop()
-    await bot.send_message(participant.id, CONTENT.messages.family.reject)
+    service.invalidate_membership(user_ids=(participant.id,), storage_ids=(user.storage.id,))
+    outbox.add(bot.send_message, participant.id, CONTENT.messages.family.reject)
 
     return ConversationHandler.END
 
 
-@handler.message(filters.ALL)
+@handler.message(filters.ALL, requires=Dependency.NONE)
 async def family_fallback(message: Message):
     await message.reply_text(CONTENT.messages.exceptions.conversation_fallback)
     return ConversationHandler.END
@@ -180,6 +232,6 @@ del handler['family_reject']
 del handler['family_fallback']
 
 
-@handler.message()
+@handler.message(requires=Dependency.NONE)
 async def all(message: Message):
     await message.reply_text(text=CONTENT.messages.regular.get())
@@ -1,14 +1,13 @@
 """
-Module to describe application's middleware as context manager wrappers.
+Module to describe application's middlewares.
 
 ### Usage:
 
->>> @asynccontextmanager
->>> async def custom_middleware(update: Update, context: CustomContext):
+>>> async def custom_middleware(call_next: HandlerCallback, update: Update, context: CustomContext):
 >>>     # <setup>
 >>>     try:
 >>>         # <add some attrubutes to context>
->>>         yield
+>>>         return await call_next(update, context)
 >>>     finally:
 >>>         # <cleanup>
 
@@ -16,136 +15,251 @@ Module to describe application's middleware as context manager wrappers.
 
 >>> app.add_middlewares([custom_middleware, ...])
 
-### Yield value:
+Middlewares are compiled into a single pipeline once for every handler at registration, so nothing is rebuilt per
+update: `call_next` is the next compiled layer (or handler itself), `update` / `context` are per update state.
 
-Only `yield None` is allowed, because `@asynccontextmanager` return help-object with `AsyncContextDecorator` in bases.
-Its `__call__` method is used to wrap handler into defined middleware. But __call__ do nothing with yielded value and
-it cannot be provided anyhow. So there is the reason to pass any values directly to `update` / `context`.
+### Dependencies:
+
+Middleware providing some resource for handlers is marked by `@provides(Dependency.<...>)`. Handlers declare which
+resources they require, so only middlewares providing them (and unmarked ones) are compiled into handler pipeline.
+
+>>> @provides(Dependency.SESSION)
+>>> async def session_middleware(call_next: HandlerCallback, update: Update, context: CustomContext):
+>>>     ...
 
 ### Extended usage:
 
+Middleware could provide `compile(call_next)` callable. It is called once for every handler at registration and
+should return `async (update, context)` layer. So any per-handler work (like signature inspection) is not repeated
+per update.
+
 >>> class middleware_as_a_class():
 >>>
->>>     def __init__(self, update: Update, context: CustomContext) -> None:
->>>         pass
+>>>     @classmethod
+>>>     def compile(cls, call_next: Callable):
+>>>         # Prepare something for that handler.
 >>>
->>>     def __call__(self, handler_callback: Callable):
 >>>         async def inner(update: Update, context: CustomContext):
->>>             # Usual decorator implementation.
 >>>             # Add some attrubutes to context / update or any other stuff.
->>>
->>>             # Call to wrapped function:
->>>             await handler_callback(**kwargs)
->>>
->>>             # Cleanup.
+>>>             return await call_next(update, context)
 >>>
 >>>         return inner
+
+### Legacy middlewares:
+
+Middlewares wrapped into `@asynccontextmanager` (only `yield None` is allowed) and classes constructed with
+`(update, context)` which wrap handler at `__call__` are still supported, but they are slower as some objects are
+created for every update.
 """
 
 import inspect
 from contextlib import asynccontextmanager
-from typing import Callable
+from enum import Flag
+from operator import attrgetter
+from types import UnionType
+from typing import Any, Awaitable, Callable, TypeAlias
 
-from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession
 from telegram import Update
 
 from application.context import CustomContext
-from configurations import CONFIG, logger
-from database.models import UserModel
-from exceptions import NoUserException
+from application.outbox import Outbox
+from configurations import CONFIG
 from service import AppService
 
 
 @asynccontextmanager
-async def session_context():
-    engine = create_async_engine(CONFIG.db_url, echo=CONFIG.sql_logs, echo_pool=CONFIG.sql_logs)
+async def session_context(engine: AsyncEngine):
     async with AsyncSession(engine) as session:
         async with session.begin():
             yield session
-    await engine.dispose()
 
 
-@asynccontextmanager
-async def session_middleware(update: Update, context: CustomContext):
-    async with session_context() as session:
+HandlerCallback: TypeAlias = Callable[[Update, CustomContext], Awaitable[Any]]
+
+
+class Dependency(Flag):
+    """
+    Resources provided by middlewares for handlers.
+    """
+
+    NONE = 0
+    SESSION = 1
+    USER = 2
+    SERVICE = 4
+    HISTORY = 8
+    ALL = SESSION | USER | SERVICE | HISTORY
+
+    def resolve(self) -> 'Dependency':
+        """
+        Add nested dependencies: history is recorded by service, service is built for user, user is taken by session.
+        """
+        dependency = self
+        if Dependency.HISTORY in dependency:
+            dependency |= Dependency.SERVICE
+        if Dependency.SERVICE in dependency:
+            dependency |= Dependency.USER
+        if Dependency.USER in dependency:
+            dependency |= Dependency.SESSION
+        return dependency
+
+
+DEPENDENCIES_ARGUMENTS: dict[str, Dependency] = {
+    'session': Dependency.SESSION,
+    'outbox': Dependency.SESSION,
+    'user': Dependency.USER,
+    'service': Dependency.SERVICE,
+}
+"""Handler arguments taken from context attributes which are assigned only by dependent middlewares. """
+
+
+def provides(dependency: Dependency):
+    def decorator(middleware: Callable):
+        middleware.provides = dependency  # type: ignore[attr-defined]
+        return middleware
+
+    return decorator
+
+
+@provides(Dependency.SESSION)
+async def session_middleware(call_next: HandlerCallback, update: Update, context: CustomContext):
+    """
+    Provide session with transaction committed when handler is done. Handler outbound calls (`context.outbox`) are
+    sent after that, when connection is already returned to pool.
+    """
+    context.outbox = outbox = Outbox()
+    async with session_context(context.application.engine) as session:
         context.session = session
-        yield
+        result = await call_next(update, context)
 
+    if CONFIG.outbox_background and outbox:
+        context.application.create_task(outbox.send(), update=update)
+    else:
+        await outbox.send()
+    return result
 
-@asynccontextmanager
-async def user_middleware(update: Update, context: CustomContext):
+
+@provides(Dependency.USER)
+async def user_middleware(call_next: HandlerCallback, update: Update, context: CustomContext):
     if not update.effective_user:
         raise ValueError
 
-    try:
-        context.user = await AppService(context.session, None, None).get_user(update.effective_user)
-    except NoUserException:
-        context.user = UserModel(tg=update.effective_user)
-        context.session.add(context.user)
-        logger.info(f'Add new user: {context.user}')
-
-    # context.user = await get_or_create(
-    #     context.session,
-    #     UserModel,
-    #     id=update.effective_user.id,
-    #     extra_kwargs={'tg': update.effective_user},  # provide `tg` for __post_init__
-    # )
+    service = AppService(context.session, None, None, cache=context.application.membership_cache)
+    context.user = await service.get_or_create_user(update.effective_user)
+    return await call_next(update, context)
 
-    # # in case user already exists at DB, `tg` must be assigned directly:
-    # if not hasattr(context.user, 'tg'):
-    #     context.user.tg = update.effective_user
 
-    yield
+async def logging_middleware(call_next: HandlerCallback, update: Update, context: CustomContext):
+    # TODO
+    return await call_next(update, context)
 
 
-@asynccontextmanager
-async def logging_middleware(update: Update, context: CustomContext):
-    # TODO
-    yield
+@provides(Dependency.SERVICE)
+async def service_middleware(call_next: HandlerCallback, update: Update, context: CustomContext):
+    context.service = AppService(
+        context.session,
+        context.user,
+        update.message,
+        context.application.history_writer,
+        context.application.membership_cache,
+    )
+    return await call_next(update, context)
 
 
-@asynccontextmanager
-async def service_middleware(update: Update, context: CustomContext):
-    context.service = AppService(context.session, context.user, update.message)
-    yield
+@provides(Dependency.HISTORY)
+async def history_middleware(call_next: HandlerCallback, update: Update, context: CustomContext):
+    await context.service.record_history(update.message)
+    return await call_next(update, context)
 
 
-@asynccontextmanager
-async def history_middleware(update: Update, context: CustomContext):
-    context.service.append_history(update.message)
-    yield
+HandlerArgument: TypeAlias = tuple[str, Callable[[Update, CustomContext], Any], type | UnionType | None]
+"""Argument name, accessor to take it from `update` / `context` and its type to check. """
 
 
 class args_middleware:  # noqa: N801
-    def __init__(self, update: Update, context: CustomContext) -> None:
-        pass
+    """
+    Provide handler arguments by their names from `update` or `context` attributes.
+
+    Arguments are resolved once per handler (see `compile`), so only precomputed accessors are called per update.
+    """
+
+    _handlers_arguments: dict[Callable, tuple[HandlerArgument, ...]] = {}
+
+    @classmethod
+    def compile(cls, call_next: Callable):
+        arguments = cls.prepare(call_next)
 
-    def __call__(self, handler_callback: Callable):
         async def inner(update: Update, context: CustomContext):
-            kwargs = self.get_handler_kwargs(handler_callback, update, context)
-            return await handler_callback(**kwargs)
+            return await call_next(**cls._collect_kwargs(call_next, arguments, update, context))
 
         return inner
 
     @classmethod
-    def get_handler_kwargs(cls, handler_callback: Callable, update: Update, context: CustomContext):
-        signature = inspect.signature(handler_callback)
-        kwargs = {}
-        for param in signature.parameters.values():
-            param.name
+    def prepare(cls, handler_callback: Callable):
+        """
+        Resolve handler arguments. Called at handler registration, so signature missmatch is risen at start up.
+        """
+        arguments: list[HandlerArgument] = []
+        for param in inspect.signature(handler_callback).parameters.values():
             if param.name == 'update':
-                kwargs[param.name] = update
+                accessor = cls._take_update
             elif param.name == 'context':
-                kwargs[param.name] = context
+                accessor = cls._take_context
+            elif hasattr(Update, param.name):
+                accessor = cls._take_from_update(param.name)
+            elif hasattr(CustomContext, param.name) or cls._is_context_attribute(param.name):
+                accessor = cls._take_from_context(param.name)
             else:
-                if hasattr(update, param.name):
-                    kwargs[param.name] = getattr(update, param.name)
-                elif hasattr(context, param.name):
-                    kwargs[param.name] = getattr(context, param.name)
-                else:
-                    raise ValueError(f'Invalid handler argument ({param}). Signature missmatch for {handler_callback}.')
+                raise ValueError(f'Invalid handler argument ({param}). Signature missmatch for {handler_callback}.')
+
+            annotation = None if param.annotation is param.empty else param.annotation
+            if annotation is not None and not isinstance(annotation, (type, UnionType)):
+                raise TypeError(f'Unsupported handler argument annotation ({param}) for {handler_callback}.')
+
+            arguments.append((param.name, accessor, annotation))
+
+        cls._handlers_arguments[handler_callback] = tuple(arguments)
+        return cls._handlers_arguments[handler_callback]
 
-            if param.annotation is not param.empty and not isinstance(kwargs[param.name], param.annotation):
-                raise TypeError(f'Invalid handler argument type ({param}). Signature missmatch for {handler_callback}.')
+    @classmethod
+    def get_handler_kwargs(cls, handler_callback: Callable, update: Update, context: CustomContext):
+        arguments = cls._handlers_arguments.get(handler_callback) or cls.prepare(handler_callback)
+        return cls._collect_kwargs(handler_callback, arguments, update, context)
+
+    @staticmethod
+    def _collect_kwargs(
+        handler_callback: Callable,
+        arguments: tuple[HandlerArgument, ...],
+        update: Update,
+        context: CustomContext,
+    ):
+        kwargs = {}
+        for name, accessor, annotation in arguments:
+            kwargs[name] = value = accessor(update, context)
+            if annotation is not None and not isinstance(value, annotation):
+                raise TypeError(f'Invalid handler argument type ({name}). Signature missmatch for {handler_callback}.')
 
         return kwargs
+
+    @staticmethod
+    def _take_update(update: Update, context: CustomContext):
+        return update
+
+    @staticmethod
+    def _take_context(update: Update, context: CustomContext):
+        return context
+
+    @staticmethod
+    def _take_from_update(name: str):
+        getter = attrgetter(name)
+        return lambda update, context: getter(update)
+
+    @staticmethod
+    def _take_from_context(name: str):
+        getter = attrgetter(name)
+        return lambda update, context: getter(context)
+
+    @staticmethod
+    def _is_context_attribute(name: str):
+        """Context attributes are declared by annotations and assigned by middlewares per update."""
+        return any(name in getattr(klass, '__annotations__', {}) for klass in CustomContext.__mro__)
@@ -0,0 +1,44 @@
+import asyncio
+from functools import partial
+from typing import Any, Awaitable, Callable
+
+from configurations import logger
+
+
+class Outbox:
+    """
+    Outbound Telegram API calls of a handler. Calls are deferred and sent by `session_middleware` after handler
+    transaction is committed and its connection is returned to pool, so connection is not kept for network round trips.
+    Calls are dropped if handler fails (nothing is committed).
+
+    >>> outbox.add(message.reply_text, 'hey')
+    >>> outbox.pause(0.5)
+    >>> outbox.add(bot.send_message, chat_id, 'hey')
+    """
+
+    def __init__(self) -> None:
+        self._calls: list[Callable[[], Awaitable[Any]]] = []
+
+    def __len__(self) -> int:
+        return len(self._calls)
+
+    def add(self, call: Callable[..., Awaitable[Any]], /, *args, **kwargs):
+        self._calls.append(partial(call, *args, **kwargs))
+
+    def pause(self, delay: float):
+        """Wait between calls (emulate typing)."""
+        self.add(asyncio.sleep, delay)
+
+    def clear(self):
+        self._calls.clear()
+
+    async def send(self):
+        """
+        Make calls one by one in the order they were added. Failed call does not prevent sending the next ones.
+        """
+        calls, self._calls = self._calls, []
+        for call in calls:
+            try:
+                await call()
+            except Exception as e:
+                logger.exception(f'Failed to send outbound call {call.func}: {e!r}')
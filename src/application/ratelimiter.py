@@ -0,0 +1,174 @@
+import asyncio
+import heapq
+import time
+from collections import Counter
+from enum import IntEnum
+from itertools import count
+from typing import Any, Callable, Coroutine
+
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+
+from configurations import logger
+
+MAX_CHATS_BUCKETS = 10_000
+"""Amount of chats buckets kept in memory. Full buckets (idle chats) are dropped when it is exceeded. """
+
+
+class Priority(IntEnum):
+    """
+    Outbound requests priority classes (lower goes first). Passed by `rate_limit_args`:
+
+    >>> await app.bot.send_photo(chat_id, photo, rate_limit_args=Priority.BROADCAST)
+    """
+
+    INTERACTIVE = 0
+    BROADCAST = 1
+
+
+class TokenBucket:
+    """
+    Refilled by `rate` tokens per second up to `capacity`. Token is reserved at once and caller waits for it, so
+    waiting callers are served in the order they came.
+    """
+
+    def __init__(self, *, rate: float, capacity: float) -> None:
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+
+    @property
+    def full(self) -> bool:
+        self._refill()
+        return self.tokens >= self.capacity
+
+    def reserve(self) -> float:
+        """
+        Take a token. Return seconds to wait for it.
+        """
+        self._refill()
+        self.tokens -= 1
+        return max(0.0, -self.tokens / self.rate)
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+
+class OutboundRateLimiter(BaseRateLimiter[Priority]):
+    """
+    Flow control of outbound Bot API requests (`ExtBot.rate_limiter`).
+
+    * Every chat has its own token bucket, then request waits for a token of global bucket.
+    * Global tokens are granted to waiting requests by their priority (see `Priority`), so interactive replies go
+    ahead of broadcasts.
+    * `RetryAfter` pauses all requests for the required time, then request is retried (up to `max_retries`).
+    * Requests without chat (`getMe`, `setWebhook`, etc.) are not limited (`getUpdates` is never passed here).
+    """
+
+    def __init__(self, *, rate: float, chat_rate: float, chat_burst: int, max_retries: int) -> None:
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+
+        self._bucket = TokenBucket(rate=rate, capacity=max(rate, 1))
+        self._chats: dict[int | str, TokenBucket] = {}
+        self._waiting: list[tuple[Priority, int, asyncio.Future]] = []
+        self._sequence = count()
+        self._requested = asyncio.Event()
+        self._paused_until = 0.0
+        self._task: asyncio.Task | None = None
+
+        self.sent = 0
+        self.retries = 0
+
+    @property
+    def queued(self) -> Counter[Priority]:
+        """Amount of requests waiting for global tokens by priority."""
+        return Counter(priority for priority, _, future in self._waiting if not future.done())
+
+    def status(self) -> str:
+        return f'Queued: {dict(self.queued)}, chats: {len(self._chats)}, sent: {self.sent}, retries: {self.retries}. '
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        if self._task:
+            self._task.cancel()
+            self._task = None
+        for *_, future in self._waiting:
+            future.cancel()
+        self._waiting.clear()
+        self._requested = asyncio.Event()  # not bound to event loop, so limiter could be started at another one
+        logger.info(f'Outbound rate limiter is stopped. {self.status()}')
+
+    async def process_request(
+        self,
+        callback: Callable[..., Coroutine[Any, Any, bool | dict | list[dict]]],
+        args: Any,
+        kwargs: dict[str, Any],
+        endpoint: str,
+        data: dict[str, Any],
+        rate_limit_args: Priority | None,
+    ) -> bool | dict | list[dict]:
+        chat_id = data.get('chat_id')
+        if chat_id is None:
+            return await callback(*args, **kwargs)
+
+        priority = Priority(rate_limit_args or Priority.INTERACTIVE)
+        retries = 0
+        while True:
+            await asyncio.sleep(self._get_chat_bucket(chat_id).reserve())
+            await self._acquire(priority)
+            try:
+                result = await callback(*args, **kwargs)
+            except RetryAfter as e:
+                if retries >= self.max_retries:
+                    raise
+                retries += 1
+                self.retries += 1
+                self._paused_until = max(self._paused_until, time.monotonic() + e.retry_after)
+                logger.warning(f'{endpoint} to {chat_id} is retried after {e.retry_after} sec. {self.status()}')
+                continue
+
+            self.sent += 1
+            return result
+
+    def _get_chat_bucket(self, chat_id: int | str) -> TokenBucket:
+        if chat_id not in self._chats and len(self._chats) >= MAX_CHATS_BUCKETS:
+            self._chats = {key: bucket for key, bucket in self._chats.items() if not bucket.full}
+        if chat_id not in self._chats:
+            self._chats[chat_id] = TokenBucket(rate=self.chat_rate, capacity=self.chat_burst)
+        return self._chats[chat_id]
+
+    async def _acquire(self, priority: Priority):
+        if not self._task or self._task.done():
+            self._task = asyncio.create_task(self._grant(), name='OutboundRateLimiter')
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiting, (priority, next(self._sequence), future))
+        self._requested.set()
+        await future
+
+    async def _grant(self):
+        """
+        Grant global tokens to waiting requests one by one: the most prior (and the first among them) goes first.
+        """
+        while True:
+            await self._requested.wait()
+            while self._waiting:
+                if (pause := self._paused_until - time.monotonic()) > 0:
+                    await asyncio.sleep(pause)
+                    continue
+
+                await asyncio.sleep(self._bucket.reserve())
+                while self._waiting:
+                    *_, future = heapq.heappop(self._waiting)
+                    if not future.done():  # skip cancelled requests
+                        future.set_result(None)
+                        break
+
+            self._requested.clear()
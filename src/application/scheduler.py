@@ -0,0 +1,135 @@
+"""
+Scheduled jobs coordinated through database, so every scheduled run is executed once by all application instances.
+
+Every instance ticks `JobScheduler` (by interval) and finds runs of its jobs which are due. Run is claimed by inserting
+its unique key (job name and scheduled time) to `job_run` table, only the instance inserted it executes the job.
+
+* Runs missed while all instances were stopped are executed after restart (within `recovery_window`). Many missed runs
+of the same job are executed once.
+* Run not finished in `lease` (instance was stopped while executing it) is claimed and executed again.
+"""
+
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import TYPE_CHECKING, Any, Awaitable, Callable
+
+from sqlalchemy import delete, func, select, update
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from configurations import logger
+from database.models import JobRunModel
+
+if TYPE_CHECKING:
+    from apscheduler.triggers.cron import CronTrigger
+
+
+@dataclass
+class CronJob:
+    name: str
+    trigger: 'CronTrigger'
+    func: Callable[[], Awaitable[Any]]
+
+    def get_due_run(self, *, after: datetime, now: datetime) -> datetime | None:
+        """
+        The latest job fire time in (`after`, `now`]. Naive UTC times.
+        """
+        due = None
+        fire_time = self.trigger.get_next_fire_time(None, after.replace(tzinfo=timezone.utc) + timedelta(seconds=1))
+        while fire_time and fire_time <= now.replace(tzinfo=timezone.utc):
+            due = fire_time
+            fire_time = self.trigger.get_next_fire_time(fire_time, fire_time + timedelta(seconds=1))
+
+        return due and due.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+class JobScheduler:
+    """
+    Cron jobs (UTC) executed once by all application instances. `tick` should be called by every instance often
+    enough (more often than jobs are scheduled).
+    """
+
+    def __init__(self, engine: AsyncEngine, *, recovery_window: timedelta, lease: timedelta) -> None:
+        self.engine = engine
+        self.recovery_window = recovery_window
+        self.lease = lease
+        self.jobs: dict[str, CronJob] = {}
+
+    def add_job(self, func: Callable[[], Awaitable[Any]], cron: str, *, name: str = ''):
+        from apscheduler.triggers.cron import CronTrigger
+
+        name = name or func.__name__
+        self.jobs[name] = CronJob(name, CronTrigger.from_crontab(cron, timezone=timezone.utc), func)
+
+    async def tick(self, now: datetime | None = None) -> list[str]:
+        """
+        Execute due runs claimed by this instance. Return names of executed jobs.
+        """
+        now = now or datetime.utcnow()
+        async with self.engine.connect() as connection:
+            query = (
+                select(JobRunModel.name, func.max(JobRunModel.scheduled_at))
+                .filter(JobRunModel.name.in_(self.jobs))
+                .group_by(JobRunModel.name)
+            )
+            last_runs: dict[str, datetime] = dict((await connection.execute(query)).tuples().all())
+
+        executed = []
+        for name, job in self.jobs.items():
+            after = max(last_runs.get(name, datetime.min), now - self.recovery_window)
+            scheduled_at = job.get_due_run(after=after, now=now)
+            if scheduled_at and (run_id := await self._claim(name, scheduled_at, now)):
+                await self._execute(job, run_id, scheduled_at)
+                executed.append(name)
+
+        for run_id, name, scheduled_at in await self._claim_expired(now):
+            logger.warning(f'Job {name} scheduled at {scheduled_at} is not finished. Execute it again. ')
+            await self._execute(self.jobs[name], run_id, scheduled_at)
+            executed.append(name)
+
+        return executed
+
+    async def _claim(self, name: str, scheduled_at: datetime, now: datetime) -> int | None:
+        statement = (
+            insert(JobRunModel)
+            .values(name=name, scheduled_at=scheduled_at, started_at=now)
+            .on_conflict_do_nothing(index_elements=['name', 'scheduled_at'])
+            .returning(JobRunModel.id)
+        )
+        async with self.engine.begin() as connection:
+            return await connection.scalar(statement)
+
+    async def _claim_expired(self, now: datetime) -> list[tuple[int, str, datetime]]:
+        # concurrent update waits for the first one and skips the row, as it is not expired anymore
+        statement = (
+            update(JobRunModel)
+            .filter(
+                JobRunModel.name.in_(self.jobs),
+                JobRunModel.finished_at.is_(None),
+                JobRunModel.started_at < now - self.lease,
+            )
+            .values(started_at=now)
+            .returning(JobRunModel.id, JobRunModel.name, JobRunModel.scheduled_at)
+        )
+        async with self.engine.begin() as connection:
+            return list((await connection.execute(statement)).tuples().all())
+
+    async def _execute(self, job: CronJob, run_id: int, scheduled_at: datetime):
+        logger.info(f'Execute job {job.name} scheduled at {scheduled_at}. ')
+        try:
+            await job.func()
+        except Exception as e:
+            logger.exception(f'Job {job.name} scheduled at {scheduled_at} is failed: {e!r}')
+
+        # previous runs are not needed anymore, the last one is kept to find the next due run
+        async with self.engine.begin() as connection:
+            await connection.execute(
+                update(JobRunModel).filter(JobRunModel.id == run_id).values(finished_at=datetime.utcnow())
+            )
+            await connection.execute(
+                delete(JobRunModel).filter(
+                    JobRunModel.name == job.name,
+                    JobRunModel.scheduled_at < scheduled_at,
+                    JobRunModel.finished_at.isnot(None),
+                )
+            )
@@ -1,21 +1,99 @@
+import asyncio
+from dataclasses import dataclass, field
+
+from sqlalchemy.ext.asyncio import AsyncEngine
+from telegram import Bot
+
 from application.middlewares import session_context
+from application.ratelimiter import Priority
 from configurations import CONFIG, logger
 from content import CONTENT
+from database.partitions import create_message_partitions, detach_message_partitions
+from exceptions import NoPhotosException
 from service import AppService
 
 
-async def send_feed_me_message_task():
+@dataclass
+class BroadcastSummary:
+    delivered: list[int] = field(default_factory=list)
+    failed: list[int] = field(default_factory=list)
+    skipped: list[int] = field(default_factory=list)
+    """Chats without user or media. """
+
+    def __str__(self) -> str:
+        return f'Delivered: {len(self.delivered)}. Failed: {len(self.failed)}. Skipped: {len(self.skipped)}. '
+
+
+async def send_subscriptions_task():
+    """
+    Send feed me messages to due subscriptions. Subscriptions are taken by batches, every batch is rescheduled and
+    committed before sending, so messages are sent at most once even with many running schedulers.
+    """
     from .application import app
 
-    logger.info('Running send_feed_me_message_task. ')
+    logger.info('Running send_subscriptions_task. ')
+
+    summary = BroadcastSummary()
+    while True:
+        async with session_context(app.engine) as session:
+            user_ids = await AppService(session, None, None).claim_due_subscriptions(limit=CONFIG.feed_me_batch_size)
+        if not user_ids:
+            break
+
+        batch = await broadcast_feed_me(app.engine, app.bot, user_ids, concurrency=CONFIG.feed_me_concurrency)
+        summary.delivered += batch.delivered
+        summary.failed += batch.failed
+        summary.skipped += batch.skipped
+
+    if summary.delivered or summary.failed or summary.skipped:
+        logger.info(f'Feed me messages are sent. {summary}')
+    return summary
 
-    async with session_context() as session:
 
-        for chat_id in CONFIG.send_feed_me_chat_ids:
-            user = await AppService(session, None, None).get_user(chat_id)
-            service = AppService(session, user, None)
+async def broadcast_feed_me(engine: AsyncEngine, bot: Bot, chat_ids: list[int], *, concurrency: int):
+    """
+    Send random media from user storage to every chat. Media for all chats is taken by a single query, then it is
+    sent by `concurrency` requests at once (connection is released already). Failed chat does not affect others.
+    """
+    summary = BroadcastSummary()
+    async with session_context(engine) as session:
+        service = AppService(session, None, None)
+        media_ids = await service.get_users_media_ids(chat_ids)
+
+        # storages without counters or with stale positions are rare, they are handled one by one:
+        for chat_id in [chat_id for chat_id, media_id in media_ids.items() if media_id is None]:
+            try:
+                media_ids[chat_id] = await AppService(session, await service.get_user(chat_id), None).get_media_id()
+            except NoPhotosException:
+                pass
+
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def send(chat_id: int, media_id: str):
+        async with semaphore:
+            logger.debug(f'Sending message to: {chat_id}')
+            try:
+                await bot.send_photo(
+                    chat_id, media_id, CONTENT.messages.feedme.get(), rate_limit_args=Priority.BROADCAST
+                )
+            except Exception as e:
+                logger.exception(f'Failed to send message to {chat_id}: {e!r}')
+                summary.failed.append(chat_id)
+            else:
+                summary.delivered.append(chat_id)
+
+    summary.skipped = [chat_id for chat_id in chat_ids if not media_ids.get(chat_id)]
+    await asyncio.gather(*(send(chat_id, media_id) for chat_id, media_id in media_ids.items() if media_id))
+    return summary
+
+
+async def maintain_history_partitions_task():
+    from .application import app
 
-            logger.info('Sending message to: %s', chat_id)
+    logger.info('Running maintain_history_partitions_task. ')
 
-            photo = await service.get_media_id()
-            await app.bot.send_photo(chat_id, photo, CONTENT.messages.feedme.get())
+    await create_message_partitions(app.engine, months_ahead=CONFIG.history_partitions_ahead)
+    if CONFIG.history_retention_months is not None:
+        await detach_message_partitions(
+            app.engine, retention_months=CONFIG.history_retention_months, drop=CONFIG.history_retention_drop
+        )
@@ -1,12 +1,19 @@
+from __future__ import annotations
+
 import logging
-from datetime import timezone
+from functools import cache
 from pathlib import Path
 from pprint import pformat
-from typing import Literal
+from typing import TYPE_CHECKING, Callable, Generic, Literal, TypeVar
 
-from apscheduler.triggers.cron import CronTrigger
 from pydantic import BaseSettings, DirectoryPath, FilePath, SecretStr
-from sqlalchemy.engine import URL
+
+from accessories import PayloadCodec
+
+if TYPE_CHECKING:
+    from sqlalchemy.engine import URL
+
+_T = TypeVar('_T')
 
 
 class AppConfig(BaseSettings):
@@ -23,30 +30,89 @@ class AppConfig(BaseSettings):
     content_filepath: FilePath = base_dir / f'bart-bot.content.yaml'
     dump_filepath: FilePath | None
 
+    feed_me_cron: str = '{minute} {hours} * * *'
+    """
+    Crontab expression (user time zone) of new subscriptions. `{minute}` and `{hours}` are taken by user id, so
+    messages are spread over the day (see `get_feed_me_cron`).
+    """
+    feed_me_hours: list[int] = [9, 14, 19]
+    """Hours of feed me messages (user time zone). Every hour is shifted by user within `feed_me_hours_spread`. """
+    feed_me_hours_spread: int = 5
+    """Amount of hours users are spread over after every of `feed_me_hours` (at least 1). """
     send_feed_me_chat_ids: list[int] = []
-    send_feed_me_message_crons: list[CronTrigger] = [
-        CronTrigger(
-            hour=4,
-            minute=0,
-            timezone=timezone.utc,
-        ),
-        CronTrigger(
-            hour=9,
-            minute=0,
-            timezone=timezone.utc,
-        ),
-        CronTrigger(
-            hour=16,
-            minute=0,
-            timezone=timezone.utc,
-        ),
-        # VBRN for local testing:
-        # CronTrigger(
-        #     hour=datetime.now(timezone.utc).hour,
-        #     minute=(datetime.now(timezone.utc) + timedelta(minutes=1)).minute,
-        #     timezone=timezone.utc,
-        # ),
-    ]
+    """Deprecated. Recipients of former broadcast, they are subscribed (UTC time zone) by `subscriptions` migration. """
+    send_subscriptions_cron: str = '* * * * *'
+    """Crontab expression (UTC) of checks for due subscriptions, they are ticked by `application.scheduler`. """
+    feed_me_batch_size: int = 500
+    """Amount of subscriptions taken at once. """
+    feed_me_concurrency: int = 32
+    """Amount of feed me messages sent at once (requests are rate limited anyway). """
+
+    webhook_warm: bool = True
+    """Keep application running between webhook invocations of the same container. """
+
+    history_payload_codec: PayloadCodec = 'jsonb'
+    """How raw messages are stored. Changing it affects new messages only, both formats are readable. """
+
+    history_partitions_ahead: int = 2
+    """Amount of next months, which history partitions are created in advance. """
+    history_retention_months: int | None = None
+    """Non-media history older than that (months) is detached from history table. Kept forever if not provided. """
+    history_retention_drop: bool = False
+    """Drop detached history (along with messages payloads) instead of keeping it as archive tables. """
+    history_maintenance_cron: str = '0 3 * * *'
+    """Crontab expression (UTC) for history partitions maintenance. """
+
+    scheduler_interval: float = 30
+    """Seconds between checks for due scheduled jobs (`application.scheduler`). """
+    scheduler_recovery_window: float = 24 * 60 * 60
+    """Seconds. Job runs missed while application was stopped are executed after restart if they are not older. """
+    scheduler_job_lease: float = 60 * 60
+    """Seconds. Job run not finished in that time is executed again (application was stopped while executing it). """
+
+    history_writer: bool = False
+    """
+    Record history by write-behind writer: rows are queued in memory and written in batches at separate transactions.
+    Queued rows are lost if process is killed, so it is for long running (polling) application only.
+    """
+    history_writer_batch_size: int = 100
+    history_writer_flush_interval: float = 1.0
+    """Seconds between flushes when batch is not full. """
+    history_writer_max_pending: int = 10_000
+    """Amount of not written rows. Recording history is waiting for free space when it is exceeded. """
+    history_writer_max_retries: int = 3
+    """Retries of failed batch per flush, then rows are kept in buffer until the next flush. """
+
+    user_cache_size: int = 10_000
+    """Amount of users kept in memory along with their storage membership. Cache is turned off if 0. """
+    user_cache_ttl: float = 5 * 60
+    """Seconds user is kept in cache. """
+
+    outbox_background: bool = False
+    """
+    Send handlers outbound calls (replies) at background tasks, so update is done right after its transaction is
+    committed. Replies of the next user update could be sent before them.
+    """
+
+    outbound_rate: float = 30
+    """Bot API requests per second (all chats). """
+    outbound_chat_rate: float = 1
+    """Bot API requests per second to the same chat. """
+    outbound_chat_burst: int = 3
+    """Amount of requests to the same chat sent at once (without waiting). """
+    outbound_max_retries: int = 3
+    """Amount of retries of request failed with `RetryAfter`. """
+
+    update_lanes: int = 16
+    """
+    Amount of updates processed concurrently. Updates are hashed by user onto lanes, so updates of the same user are
+    processed sequentially in the order they were received.
+    """
+    update_pending_max: int = 256
+    """
+    Limit of fetched updates processed at once (`concurrent_updates`). Slot is taken once update lane is free, so updates
+    waiting for a busy lane do not take slots of other lanes.
+    """
 
     db: str = 'postgresql'
     db_dialect: str = 'asyncpg'
@@ -56,8 +122,28 @@ class AppConfig(BaseSettings):
     db_port: int = 5432
     db_name: str
 
+    db_pool_size: int = 10
+    """Amount of connections kept opened by engine pool. """
+    db_pool_min_size: int = 2
+    """Amount of connections opened at application start up. """
+    db_pool_max_overflow: int = 10
+    db_pool_recycle: int = 30 * 60
+    """Seconds after which connection is reopened. """
+    db_pool_pre_ping: bool = True
+
+    def get_feed_me_cron(self, user_id: int) -> str:
+        """
+        Schedule of new user subscription. Users are spread over minutes and over `feed_me_hours_spread` hours after
+        every of `feed_me_hours` by their ids.
+        """
+        shift = user_id // 60 % self.feed_me_hours_spread
+        hours = ','.join(str((hour + shift) % 24) for hour in self.feed_me_hours)
+        return self.feed_me_cron.format(minute=user_id % 60, hours=hours)
+
     @property
-    def db_url(self):
+    def db_url(self) -> URL:
+        from sqlalchemy.engine import URL
+
         return URL.create(
             drivername=f'{self.db}+{self.db_dialect}',
             username=self.db_user,
@@ -75,11 +161,42 @@ class AppConfig(BaseSettings):
         return '\n' + pformat(self.dict())
 
 
-CONFIG = AppConfig()
+class Lazy(Generic[_T]):
+    """
+    Proxy to module level singleton. Wrapped object is created at first access, so importing module does not pay for
+    it (reading env files, parsing content, etc).
+    """
+
+    def __init__(self, factory: Callable[[], _T]) -> None:
+        object.__setattr__(self, '_factory', factory)
+
+    def __getattr__(self, name: str):
+        return getattr(self._factory(), name)
+
+    def __setattr__(self, name: str, value) -> None:
+        setattr(self._factory(), name, value)
+
+    def __delattr__(self, name: str) -> None:
+        delattr(self._factory(), name)
+
+    def __str__(self) -> str:
+        return str(self._factory())
+
+    def __repr__(self) -> str:
+        return f'<Lazy {self._factory.__qualname__}>'
+
+
+@cache
+def get_config() -> AppConfig:
+    config = AppConfig()
+    logger.setLevel(config.log_level)
+    return config
+
+
+CONFIG: AppConfig = Lazy(get_config)  # type: ignore[assignment]
 
 # Logging.
 logger = logging.getLogger(__name__)
-logger.setLevel(CONFIG.log_level)
 
 handler = logger.handlers and logger.handlers[0] or logging.StreamHandler()
 handler.setFormatter(logging.Formatter('%(levelname)s [%(name)s] %(message)s'))
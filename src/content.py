@@ -1,12 +1,17 @@
 from __future__ import annotations
 
+import hashlib
+import json
 import random
+import sys
+from functools import cache
+from pathlib import Path
+from typing import get_origin
 
-import yaml
 from pydantic import BaseModel
 from pydantic.validators import list_validator
 
-from configurations import CONFIG
+from configurations import CONFIG, Lazy, logger
 
 
 class Replyes(list[str]):
@@ -35,11 +40,62 @@ class BotContent(BaseModel):
 
     @classmethod
     def parse_yaml(cls, filepath: str):
+        import yaml
+
         with open(filepath, 'r') as file:
             content = yaml.safe_load(file)
 
         return cls.parse_obj(content)
 
+    @classmethod
+    def load(cls, filepath: str | Path):
+        """
+        Load content from JSON snapshot (no YAML parsing). Fallback to YAML if snapshot is missing or outdated.
+        Snapshot content is validated at build step, so models are constructed without validation.
+        """
+        snapshot_filepath = cls.get_snapshot_filepath(filepath)
+        try:
+            with open(snapshot_filepath, 'r') as file:
+                snapshot = json.load(file)
+            source_hash, content = snapshot['source_hash'], snapshot['content']
+        except (OSError, ValueError, TypeError, KeyError) as e:
+            logger.warning(f'Content snapshot is not loaded ({e!r}). Parse {filepath}. ')
+            return cls.parse_yaml(filepath)
+
+        if source_hash != cls.get_source_hash(filepath):
+            logger.warning(f'Content snapshot is outdated. Parse {filepath}. ')
+            return cls.parse_yaml(filepath)
+
+        return construct_model(cls, content)
+
+    @classmethod
+    def dump_snapshot(cls, filepath: str | Path):
+        """
+        Build step. Validate YAML content and store it as JSON snapshot (plain data) next to the source file.
+        """
+        content = cls.parse_yaml(filepath)
+        snapshot_filepath = cls.get_snapshot_filepath(filepath)
+        with open(snapshot_filepath, 'w') as file:
+            json.dump(
+                {'source_hash': cls.get_source_hash(filepath), 'content': content.dict()}, file, ensure_ascii=False
+            )
+
+        logger.info(f'Content snapshot is stored at {snapshot_filepath}. ')
+        return snapshot_filepath
+
+    @staticmethod
+    def get_snapshot_filepath(filepath: str | Path):
+        return Path(filepath).with_suffix('.json')
+
+    @staticmethod
+    def get_source_hash(filepath: str | Path):
+        """
+        Snapshot is keyed by content source and by content models definition (this module).
+        """
+        source_hash = hashlib.sha256(Path(filepath).read_bytes())
+        source_hash.update(Path(__file__).read_bytes())
+        return source_hash.hexdigest()
+
     class Config:
         ...
         # TODO frozen
@@ -74,6 +130,12 @@ class FamilyHandlingReplyes(BaseModel):
     reject: str
 
 
+class SubscriptionReplyes(BaseModel):
+    subscribe: str
+    unsubscribe: str
+    invalid_timezone: str
+
+
 class BotMessages(BaseModel):
     start: str
     regular: Replyes
@@ -84,8 +146,43 @@ class BotMessages(BaseModel):
     send_photo: SendPhotoReplyes
     receive_photo: ReceivePhotoReplyes
     family: FamilyHandlingReplyes
+    subscription: SubscriptionReplyes
     exceptions: ExceptionMessages  # TODO move to BotContent layer
 
 
 BotContent.update_forward_refs()
-CONTENT = BotContent.parse_yaml(CONFIG.content_filepath)
+
+
+def construct_model(model: type[BaseModel], data: dict):
+    """
+    Construct model with nested models from already validated data (see `BaseModel.construct`), so validators are
+    not running.
+    """
+    values = {}
+    for name, field in model.__fields__.items():
+        if name not in data:
+            continue  # default is set by construct
+
+        value = data[name]
+        if isinstance(field.outer_type_, type) and issubclass(field.outer_type_, BaseModel):
+            value = construct_model(field.outer_type_, value)
+        elif field.outer_type_ is Replyes:
+            value = Replyes(value)
+        elif get_origin(field.outer_type_) is tuple:
+            value = tuple(value)
+        values[name] = value
+
+    return model.construct(**values)
+
+
+@cache
+def get_content() -> BotContent:
+    return BotContent.load(CONFIG.content_filepath)
+
+
+CONTENT: BotContent = Lazy(get_content)  # type: ignore[assignment]
+
+
+if __name__ == '__main__':
+    # build step: python src/content.py [path/to/content.yaml]
+    BotContent.dump_snapshot(sys.argv[1] if len(sys.argv) > 1 else CONFIG.content_filepath)
@@ -1,5 +1,15 @@
 from .base import BaseModel
-from .engine import engine
+from .cache import MembershipCache
+from .engine import create_engine, warmup_engine
 from .models import MessageModel, UserModel
+from .writer import HistoryWriter
 
-__all__ = ['BaseModel', 'engine', 'UserModel', 'MessageModel']
+__all__ = [
+    'BaseModel',
+    'create_engine',
+    'warmup_engine',
+    'HistoryWriter',
+    'MembershipCache',
+    'UserModel',
+    'MessageModel',
+]
@@ -0,0 +1,69 @@
+import pickle
+import time
+from collections import OrderedDict
+from typing import NamedTuple
+
+from database.models import UserModel
+
+
+class _Entry(NamedTuple):
+    expires_at: float
+    storage_ids: frozenset[int]
+    data: bytes
+
+
+class MembershipCache:
+    """
+    In-process LRU cache (with TTL) of users with their storage membership: `UserModel` with storage and its requests,
+    as it is loaded by `AppService.get_user`.
+
+    * Users are kept pickled, so cache holds a snapshot, not an ORM object bound to (closed) session. Every hit is a
+    new detached copy to be merged into the current session (`session.merge(user, load=False)`, no queries).
+    * Membership is changed by family handlers only, they invalidate affected users explicitly.
+    """
+
+    def __init__(self, *, maxsize: int, ttl: float) -> None:
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[int, _Entry] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, user_id: int) -> UserModel | None:
+        entry = self._entries.get(user_id)
+        if not entry or entry.expires_at < time.monotonic():
+            self._entries.pop(user_id, None)
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(user_id)
+        self.hits += 1
+        return pickle.loads(entry.data)
+
+    def put(self, user: UserModel):
+        """
+        Snapshot user. It must be loaded along with storage and storage requests.
+        """
+        storage_ids = frozenset(id for id in (user.storage_id, user.storage_request_id) if id is not None)
+        self._entries[user.id] = _Entry(time.monotonic() + self.ttl, storage_ids, pickle.dumps(user))
+        self._entries.move_to_end(user.id)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, *, user_ids: tuple[int, ...] = (), storage_ids: tuple[int, ...] = ()):
+        """
+        Forget users and all participants of storages (and users requested them).
+        """
+        for user_id in user_ids:
+            self._entries.pop(user_id, None)
+
+        if storage_ids:
+            storages = set(storage_ids)
+            for user_id in [user_id for user_id, entry in self._entries.items() if entry.storage_ids & storages]:
+                del self._entries[user_id]
+
+    def clear(self):
+        self._entries.clear()
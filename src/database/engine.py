@@ -1,5 +1,31 @@
-from sqlalchemy.ext.asyncio import create_async_engine
+import asyncio
 
-from configurations import CONFIG
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
 
-engine = create_async_engine(CONFIG.db_url, echo=CONFIG.sql_logs)
+from configurations import CONFIG, AppConfig
+
+
+def create_engine(config: AppConfig = CONFIG) -> AsyncEngine:
+    """
+    Create engine with connection pool configured by application settings.
+
+    Engine should be created once per process and shared between all updates (see `LayeredApplication.engine`).
+    """
+    return create_async_engine(
+        config.db_url,
+        echo=config.sql_logs,
+        echo_pool=config.sql_logs,
+        pool_size=config.db_pool_size,
+        max_overflow=config.db_pool_max_overflow,
+        pool_recycle=config.db_pool_recycle,
+        pool_pre_ping=config.db_pool_pre_ping,
+    )
+
+
+async def warmup_engine(engine: AsyncEngine, size: int):
+    """
+    Open `size` connections at once and release them back to the pool, so the first updates do not pay for
+    connection handshake.
+    """
+    connections = await asyncio.gather(*(engine.connect() for _ in range(size)))
+    await asyncio.gather(*(connection.close() for connection in connections))
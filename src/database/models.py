@@ -1,21 +1,32 @@
 from __future__ import annotations
+
+import json
+import zlib
+from collections import Counter
 from dataclasses import field
+from datetime import datetime, timezone
+from typing import Literal
+from zoneinfo import ZoneInfo
 
-from sqlalchemy import ForeignKey
+from sqlalchemy import DDL, ForeignKey, Index, Select, UniqueConstraint, event, sql
+from sqlalchemy.dialects.postgresql import JSONB, insert
+from sqlalchemy.ext.asyncio import AsyncConnection
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 from telegram import User
 
-from accessories import MediaType
+from accessories import MediaType, PayloadCodec
 from database.base import BackRef, BaseModel
 
 
 class UserModel(BaseModel):
     tg: User = field(repr=False)
 
-    storage_id: Mapped[int] = mapped_column(ForeignKey('storage.id'), init=False)
+    storage_id: Mapped[int] = mapped_column(ForeignKey('storage.id'), init=False, index=True)
     storage: Mapped[StorageModel] = relationship(foreign_keys=[storage_id], init=False, backref='participants')
 
-    storage_request_id: Mapped[int | None] = mapped_column(ForeignKey('storage.id'), init=False, default=None)
+    storage_request_id: Mapped[int | None] = mapped_column(
+        ForeignKey('storage.id'), init=False, default=None, index=True
+    )
     storage_request: Mapped[StorageModel | None] = relationship(
         foreign_keys=[storage_request_id], init=False, default=None, backref='requests'
     )
@@ -44,14 +55,259 @@ class StorageModel(BaseModel):
     requests: BackRef[list[UserModel]]
 
 
+def _is_media(context) -> bool:
+    return context.get_current_parameters()['media_id'] is not None
+
+
 class MessageModel(BaseModel):
+    """
+    Messages history. Table is partitioned by month of `created_at`, every month is sub partitioned to media and
+    non-media messages, so old non-media messages could be detached as a whole (see `database.partitions`).
+    """
+
+    __table_args__ = (
+        Index(
+            'ix_message_storage_media',
+            'storage_id',
+            'media_type',
+            'media_seq',
+            postgresql_where=sql.text('media_id IS NOT NULL'),
+        ),
+        Index('ix_message_user_id_media_group_id', 'user_id', 'media_group_id'),
+        Index('ix_message_chat_id_message_id', 'chat_id', 'message_id'),
+        {'postgresql_partition_by': 'RANGE (created_at)'},
+    )
+
+    # primary key includes partitions keys, as it is required by Postgres:
+    id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True, default=None)
+    created_at: Mapped[datetime] = mapped_column(
+        primary_key=True, server_default=sql.func.now(), init=False, repr=False
+    )
+    is_media: Mapped[bool] = mapped_column(primary_key=True, default=None, insert_default=_is_media, repr=False)
+
     user_id: Mapped[int] = mapped_column(ForeignKey('user.id'))
     user: BackRef[UserModel]
+    storage_id: Mapped[int] = mapped_column(ForeignKey('storage.id'))
+    """Storage message belongs to. Taken from user at writing and moved along with him to another storage. """
 
+    chat_id: Mapped[int | None] = mapped_column(default=None)
     message_id: Mapped[int]  # telegram has NOT uniq message ids for different chats, so it could not by used as PK
     media_id: Mapped[str | None] = mapped_column(repr=False)
     media_type: Mapped[MediaType | None]
     media_group_id: Mapped[str | None]
+    media_seq: Mapped[int | None] = mapped_column(init=False, default=None, repr=False)
+    """
+    Dense media position at storage among media of the same type: [0, count). Allocated from `MediaCounterModel` on
+    insert and used for taking random media by index lookup.
+    """
+
+    payload: Mapped[MessagePayloadModel | None] = relationship(
+        primaryjoin='MessageModel.id == foreign(MessagePayloadModel.id)', default=None, lazy='raise', repr=False
+    )
+    """
+    Full message as it is. Stored at separate table and never loaded implicitly. Load it explicitly when it is needed:
+
+    >>> await session.refresh(message, ['payload'])
+    >>> select(MessageModel).options(selectinload(MessageModel.payload))
+    """
+
+    @classmethod
+    def get_values(cls, data: dict, *, user_id: int, storage_id: int, codec: PayloadCodec) -> dict:
+        """
+        Table columns values for Telegram message data (`Message.to_dict()`), so rows could be built without
+        constructing PTB objects. Encoded payload columns values are provided by `payload` key.
+        """
+        media_id = None
+        media_type = None
+
+        if photo := data.get('photo'):
+            media_id = photo[-1]['file_id']
+            media_type = MediaType.photo.value
+        elif video := data.get('video'):
+            media_id = video['file_id']
+            media_type = MediaType.video.value
+
+        return dict(
+            user_id=user_id,
+            storage_id=storage_id,
+            chat_id=data['chat']['id'],
+            message_id=data['message_id'],
+            media_id=media_id,
+            media_type=media_type,
+            media_group_id=data.get('media_group_id'),
+            is_media=media_id is not None,
+            payload=MessagePayloadModel.get_values(data, codec=codec),
+        )
+
+
+class MessagePayloadModel(BaseModel):
+    """
+    Raw message (`Message.to_dict()`). Append-only cold storage, split from `MessageModel`, so hot history table stays
+    narrow. Primary key is the message id (not a foreign key, as partitioned `message` has composite primary key).
+    """
+
+    id: Mapped[int] = mapped_column(primary_key=True, autoincrement=False, default=None)
+    json: Mapped[dict | None] = mapped_column(JSONB, default=None, repr=False)
+    compressed: Mapped[bytes | None] = mapped_column(default=None, repr=False)
+    """zlib compressed JSON. """
+
+    @property
+    def data(self) -> dict:
+        return self.decode(self.json, self.compressed)
+
+    @classmethod
+    def get_values(cls, data: dict, *, codec: PayloadCodec) -> dict:
+        if codec == 'zlib':
+            return dict(json=None, compressed=zlib.compress(json.dumps(data).encode()))
+        return dict(json=data, compressed=None)
+
+    @staticmethod
+    def decode(data: dict | None, compressed: bytes | None) -> dict:
+        if compressed is not None:
+            return json.loads(zlib.decompress(compressed))
+        return data or {}
+
+
+class MediaCounterModel(BaseModel):
+    """
+    Amount of media messages at storage by media type. Incremented at the same transaction with every media message
+    insert, so the amount could be taken without scanning history. Incremented value is used as a new media position
+    (see `MessageModel.media_seq`).
+    """
+
+    __table_args__ = (UniqueConstraint('storage_id', 'media_type'),)
+
+    storage_id: Mapped[int] = mapped_column(ForeignKey('storage.id'))
+    media_type: Mapped[MediaType]
+    count: Mapped[int] = mapped_column(default=0)
+
+    @classmethod
+    def upsert(
+        cls, values: Select | list[dict], *, on_conflict: Literal['increment', 'replace', 'ignore'] = 'increment'
+    ):
+        """
+        Insert counters. Existing ones are incremented by provided `count`, replaced by it or left as is.
+        """
+        statement = insert(cls)
+        if isinstance(values, Select):
+            statement = statement.from_select(['storage_id', 'media_type', 'count'], values)
+        else:
+            statement = statement.values(values)
+
+        if on_conflict == 'ignore':
+            return statement.on_conflict_do_nothing(index_elements=['storage_id', 'media_type'])
+
+        count = cls.count + statement.excluded.count if on_conflict == 'increment' else statement.excluded.count
+        return statement.on_conflict_do_update(
+            index_elements=['storage_id', 'media_type'],
+            set_={'count': count, 'updated_at': sql.func.now()},
+        )
+
+
+class SubscriptionModel(BaseModel):
+    """
+    Feed me messages subscription. Messages are sent by user `cron` schedule at user `timezone`. Due subscriptions are
+    taken by `next_run_at` index and rescheduled (see `application.tasks.send_subscriptions_task`).
+    """
+
+    user_id: Mapped[int] = mapped_column(ForeignKey('user.id', ondelete='CASCADE'), unique=True)
+    cron: Mapped[str]
+    """Crontab expression at user timezone. """
+    timezone: Mapped[str] = mapped_column(default='UTC')
+    """IANA time zone name. """
+    next_run_at: Mapped[datetime] = mapped_column(init=False, index=True)
+    """UTC. """
+
+    def schedule(self, after: datetime | None = None):
+        """
+        Set the next run time after provided UTC time (now by default).
+        """
+        from apscheduler.triggers.cron import CronTrigger
+
+        trigger = CronTrigger.from_crontab(self.cron, timezone=ZoneInfo(self.timezone))
+        after = (after or datetime.utcnow()).replace(tzinfo=timezone.utc)
+        self.next_run_at = trigger.get_next_fire_time(None, after).astimezone(timezone.utc).replace(tzinfo=None)
+
+
+class JobRunModel(BaseModel):
+    """
+    Runs of scheduled jobs (see `application.scheduler`). Run is claimed by inserting its unique key (job name and
+    scheduled time), so it is executed by a single application instance. Times are UTC.
+    """
+
+    __table_args__ = (UniqueConstraint('name', 'scheduled_at'),)
+
+    name: Mapped[str]
+    scheduled_at: Mapped[datetime]
+    started_at: Mapped[datetime]
+    """Time run is claimed at. Not finished runs are claimed again when it is expired (instance was stopped). """
+    finished_at: Mapped[datetime | None] = mapped_column(default=None)
+
+
+# partitions are managed at runtime, default one makes table writable right after it is created
+event.listen(
+    MessageModel.__table__,
+    'after_create',
+    DDL('CREATE TABLE message_default PARTITION OF message DEFAULT').execute_if(dialect='postgresql'),
+)
+
+
+@event.listens_for(MessageModel, 'before_insert')
+def allocate_media_seq(mapper, connection, target: MessageModel):
+    if not target.media_id or not target.media_type:
+        return
+
+    values = [dict(storage_id=target.storage_id, media_type=MediaType(target.media_type).value, count=1)]
+    count = connection.execute(MediaCounterModel.upsert(values).returning(MediaCounterModel.count)).scalar_one()
+    target.media_seq = count - 1
+
+
+async def allocate_media_seqs(connection: AsyncConnection, rows: list[dict]):
+    """
+    Allocate media positions for `MessageModel` rows (table columns values) inserted in bulk, by single counters upsert.
+    """
+    media = Counter((row['storage_id'], row['media_type']) for row in rows if row['media_id'] and row['media_type'])
+    if not media:
+        return
+
+    values = [dict(storage_id=key[0], media_type=key[1], count=count) for key, count in media.items()]
+    statement = MediaCounterModel.upsert(values).returning(
+        MediaCounterModel.storage_id, MediaCounterModel.media_type, MediaCounterModel.count
+    )
+    seq = {
+        (storage_id, media_type): count - media[storage_id, media_type]
+        for storage_id, media_type, count in await connection.execute(statement)
+    }
+    for row in rows:
+        if row['media_id'] and row['media_type']:
+            row['media_seq'] = seq[row['storage_id'], row['media_type']]
+            seq[row['storage_id'], row['media_type']] += 1
+
+
+async def allocate_message_ids(connection: AsyncConnection, rows: list[dict]):
+    """
+    Take `MessageModel` ids from sequence for rows inserted in bulk, so their payloads could be inserted along.
+    """
+    statement = sql.select(sql.func.nextval(sql.func.pg_get_serial_sequence('message', 'id'))).select_from(
+        sql.func.generate_series(1, len(rows))
+    )
+    for row, id in zip(rows, (await connection.execute(statement)).scalars()):
+        row['id'] = id
+
+
+async def insert_messages(connection: AsyncConnection, rows: list[dict]):
+    """
+    Insert `MessageModel` rows (table columns values with payload, see `MessageModel.get_values`) in bulk.
+    """
+    await allocate_media_seqs(connection, rows)
+    await allocate_message_ids(connection, rows)
+
+    messages = []
+    payloads = []
+    for row in rows:
+        message = dict(row, media_seq=row.get('media_seq'))
+        payloads.append(dict(message.pop('payload'), id=row['id']))
+        messages.append(message)
 
-    json: Mapped[dict] = mapped_column(repr=False)
-    """Full message as it is. """
+    await connection.execute(insert(MessageModel), messages)
+    await connection.execute(insert(MessagePayloadModel), payloads)
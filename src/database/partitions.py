@@ -0,0 +1,121 @@
+"""
+Monthly partitions of messages history (see `MessageModel`).
+
+Every month is a partition of `message` table (`message_y2026m10`), sub partitioned to media (`message_y2026m10_media`)
+and non-media (`message_y2026m10_text`) messages. Partitions are created ahead by `create_message_partitions`, messages
+out of created partitions are written to `message_default`. Bot does not read old non-media messages, so their
+partitions are detached by `detach_message_partitions` and kept as standalone archive tables or dropped.
+"""
+
+import re
+from datetime import date, datetime
+
+from sqlalchemy import text
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from configurations import logger
+
+PARTITION_NAME = re.compile(r'^message_(default|y\d{4}m\d{2}(_media|_text)?)$')
+"""Names of all partitions (and detached ones). """
+_MONTH_PARTITION_NAME = re.compile(r'^message_y(\d{4})m(\d{2})$')
+
+SELECT_TEXT_PARTITIONS = text(
+    '''
+    SELECT month.relname, child.relname
+    FROM pg_inherits month_inherits
+    JOIN pg_class month ON month.oid = month_inherits.inhrelid
+    JOIN pg_inherits child_inherits ON child_inherits.inhparent = month.oid
+    JOIN pg_class child ON child.oid = child_inherits.inhrelid
+    WHERE month_inherits.inhparent = 'message'::regclass
+    '''
+)
+
+
+def add_months(month: date, amount: int) -> date:
+    index = month.year * 12 + month.month - 1 + amount
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def get_partition_name(month: date) -> str:
+    return f'message_y{month.year:04}m{month.month:02}'
+
+
+async def create_message_partitions(engine: AsyncEngine, *, months_ahead: int, today: date | None = None) -> list[str]:
+    """
+    Create partitions for current month and `months_ahead` next ones. Messages of these months already written to
+    default partition are moved to created one. Return names of created partitions.
+    """
+    current = (today or datetime.utcnow().date()).replace(day=1)
+    created = []
+
+    for month in (add_months(current, amount) for amount in range(months_ahead + 1)):
+        name = get_partition_name(month)
+        start, end = month.isoformat(), add_months(month, 1).isoformat()
+        try:
+            async with engine.begin() as connection:
+                if await connection.scalar(text('SELECT to_regclass(:name)'), {'name': name}):
+                    continue
+
+                await connection.execute(text('CREATE TEMPORARY TABLE message_moved (LIKE message) ON COMMIT DROP'))
+                await connection.execute(
+                    text(
+                        f'''
+                        WITH moved AS (
+                            DELETE FROM message_default WHERE created_at >= '{start}' AND created_at < '{end}'
+                            RETURNING *
+                        )
+                        INSERT INTO message_moved SELECT * FROM moved
+                        '''
+                    )
+                )
+                await connection.execute(
+                    text(
+                        f'''
+                        CREATE TABLE {name} PARTITION OF message
+                        FOR VALUES FROM ('{start}') TO ('{end}') PARTITION BY LIST (is_media)
+                        '''
+                    )
+                )
+                await connection.execute(text(f'CREATE TABLE {name}_media PARTITION OF {name} FOR VALUES IN (true)'))
+                await connection.execute(text(f'CREATE TABLE {name}_text PARTITION OF {name} FOR VALUES IN (false)'))
+                await connection.execute(text('INSERT INTO message SELECT * FROM message_moved'))
+        except DBAPIError as e:
+            logger.exception(f'Failed to create history partition {name}: {e!r}')
+            continue
+
+        logger.info(f'History partition {name} is created. ')
+        created.append(name)
+
+    return created
+
+
+async def detach_message_partitions(
+    engine: AsyncEngine, *, retention_months: int, drop: bool = False, today: date | None = None
+) -> list[str]:
+    """
+    Detach non-media partitions of months older than `retention_months`. Detached partitions are kept as standalone
+    tables (to be archived by `pg_dump`) or dropped along with their payloads. Return names of detached partitions.
+    """
+    expired = add_months((today or datetime.utcnow().date()).replace(day=1), -retention_months)
+    async with engine.connect() as connection:
+        partitions = (await connection.execute(SELECT_TEXT_PARTITIONS)).all()
+
+    detached = []
+    for month_partition, partition in sorted(partitions):
+        match = _MONTH_PARTITION_NAME.match(month_partition)
+        if not match or partition != f'{month_partition}_text':
+            continue
+        if date(int(match[1]), int(match[2]), 1) >= expired:
+            continue
+
+        async with engine.begin() as connection:
+            await connection.execute(text(f'ALTER TABLE {month_partition} DETACH PARTITION {partition}'))
+            if drop:
+                await connection.execute(text(f'DELETE FROM message_payload WHERE id IN (SELECT id FROM {partition})'))
+                await connection.execute(text(f'DROP TABLE {partition}'))
+
+        logger.info(f'History partition {partition} is {"dropped" if drop else "detached"}. ')
+        detached.append(partition)
+
+    return detached
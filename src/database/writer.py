@@ -0,0 +1,210 @@
+import asyncio
+from typing import Awaitable, Callable
+
+from sqlalchemy import event
+from sqlalchemy.exc import DataError, IntegrityError
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession
+from sqlalchemy.orm import Session, SessionTransaction
+
+from configurations import logger
+from database.models import insert_messages
+
+SESSION_ROWS_KEY = 'history_writer_rows'
+"""Session info key of rows queued when session transaction is committed. """
+
+
+class HistoryWriter:
+    """
+    Write-behind history recorder. Rows are queued in memory and flushed by multi-row inserts at separate transactions
+    when batch is full or by time.
+
+    * Buffer is bounded: `put` waits for free space when `max_pending` rows are not flushed yet (backpressure).
+    * Rows put by handler transaction are queued when it is committed, and dropped if it is rolled back.
+    * At-least-once: queued row is kept in buffer until its batch is committed, failed batches are retried (up to
+    `max_retries` times per flush, then at the next flush). Rows rejected by database (integrity errors) are dropped,
+    so they do not block the buffer.
+    * Queued rows are counted along with written ones, see `count`.
+    """
+
+    def __init__(
+        self, engine: AsyncEngine, *, batch_size: int, flush_interval: float, max_pending: int, max_retries: int = 3
+    ) -> None:
+        self.engine = engine
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.max_retries = max_retries
+
+        self._pending: list[dict] = []
+        self._slots = asyncio.Semaphore(max_pending)
+        self._flush_requested = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._stopping = asyncio.Event()
+        """Set at stop: flushing by time is finished after the current batch, so it is not cancelled mid-write. """
+        self._task: asyncio.Task | None = None
+
+        self._commits = 0
+        self._committed = asyncio.Event()
+        """Cleared while batch is committing: it is already visible at database, but is not removed from buffer. """
+        self._committed.set()
+
+    @property
+    def running(self):
+        return bool(self._task and not self._task.done())
+
+    def start(self):
+        if self.running:
+            raise RuntimeError('History writer already started.')
+        self._stopping.clear()
+        self._task = asyncio.create_task(self._run(), name='HistoryWriter')
+
+    async def stop(self, *, retries: int = 3):
+        """
+        Stop flushing by time and flush all queued rows. Failed batches are retried `retries` times, then rows are
+        dropped.
+        """
+        if self._task:
+            self._stopping.set()
+            self._flush_requested.set()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+        await self.flush(retries=retries)
+        if self._pending:
+            logger.error(f'History writer is stopped. {len(self._pending)} rows are not written and dropped. ')
+
+    async def put(self, row: dict, *, session: AsyncSession | None = None):
+        """
+        Queue `MessageModel` row (see `MessageModel.get_values`). Waits for free space if buffer is full.
+
+        `session`: row is queued when session transaction is committed (and dropped if it is rolled back), so rows
+        referencing data of not committed transaction (new user, etc.) are not written.
+        """
+        await self._slots.acquire()
+        if not session:
+            self._queue([row])
+            return
+
+        rows = session.info.get(SESSION_ROWS_KEY)
+        if rows is None:
+            rows = session.info[SESSION_ROWS_KEY] = []
+            event.listen(session.sync_session, 'after_commit', self._on_commit, once=True)
+            event.listen(session.sync_session, 'after_transaction_end', self._on_transaction_end, once=True)
+        rows.append(row)
+
+    async def count(
+        self,
+        predicate: Callable[[dict], bool],
+        query: Callable[[], Awaitable[int]],
+        *,
+        session: AsyncSession | None = None,
+    ) -> int:
+        """
+        Count rows by database `query` along with queued rows matching `predicate` (including rows put by `session`
+        transaction), so every row is counted once. Counting is repeated if any batch is committed meanwhile. Flushing
+        is not blocked, as it could wait for the caller transaction.
+        """
+        while True:
+            await self._committed.wait()
+            commits = self._commits
+            pending = self.pending(predicate, session=session)
+            total = await query()
+            if commits == self._commits:
+                return total + pending
+
+    def pending(self, predicate: Callable[[dict], bool], *, session: AsyncSession | None = None) -> int:
+        """
+        Amount of queued rows (not committed yet) matching predicate.
+        """
+        rows = self.get_session_rows(session) if session else []
+        return sum(1 for row in self._pending + rows if predicate(row))
+
+    @staticmethod
+    def get_session_rows(session: AsyncSession) -> list[dict]:
+        """
+        Rows put by session transaction, they are queued when it is committed.
+        """
+        return session.info.get(SESSION_ROWS_KEY, [])
+
+    async def flush(self, *, retries: int | None = None):
+        """
+        Write all queued rows. Failed batches are retried `retries` times (`max_retries` by default), then rows are
+        kept in buffer until the next flush.
+        """
+        retries = self.max_retries if retries is None else retries
+        attempt = 0
+        async with self._flush_lock:
+            while self._pending:
+                batch = self._pending[: self.batch_size]
+                try:
+                    await self._write_batch(batch)
+                except Exception as e:
+                    attempt += 1
+                    logger.exception(f'History writer failed to write {len(batch)} rows (attempt {attempt}): {e!r}')
+                    if attempt > retries:
+                        return
+                    await asyncio.sleep(min(self.flush_interval * attempt, 30))
+                    continue
+
+                attempt = 0
+
+    async def _run(self):
+        while not self._stopping.is_set():
+            try:
+                await asyncio.wait_for(self._flush_requested.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+
+            if self._stopping.is_set():
+                break  # final flush is done by stop
+            self._flush_requested.clear()
+            await self.flush()
+
+    async def _write_batch(self, batch: list[dict]):
+        try:
+            await self._write(batch)
+        except (IntegrityError, DataError) as e:
+            # batch is written row by row, so rows rejected by database do not block the others
+            logger.warning(f'History writer failed to write {len(batch)} rows: {e!r}. Write them one by one. ')
+            for row in batch:
+                try:
+                    await self._write([row])
+                except (IntegrityError, DataError) as e:
+                    del self._pending[0]
+                    logger.error(
+                        f'History writer dropped message {row.get("message_id")} of user {row.get("user_id")}: {e!r}'
+                    )
+                self._slots.release()
+            return
+
+        for _ in batch:
+            self._slots.release()
+
+    async def _write(self, batch: list[dict]):
+        async with self.engine.connect() as connection:
+            await insert_messages(connection, batch)
+
+            self._commits += 1
+            self._committed.clear()
+            try:
+                await connection.commit()
+                del self._pending[: len(batch)]  # right after commit, so rows are not counted twice
+            finally:
+                self._committed.set()
+
+        logger.debug(f'History writer: {len(batch)} rows are written. ')
+
+    def _queue(self, rows: list[dict]):
+        self._pending.extend(rows)
+        if len(self._pending) >= self.batch_size:
+            self._flush_requested.set()
+
+    def _on_commit(self, session: Session):
+        self._queue(session.info.pop(SESSION_ROWS_KEY, []))
+
+    def _on_transaction_end(self, session: Session, transaction: SessionTransaction):
+        # rows are left only if transaction is not committed (rolled back or closed)
+        if rows := session.info.pop(SESSION_ROWS_KEY, None):
+            logger.debug(f'History writer: {len(rows)} rows are dropped, as their transaction is rolled back. ')
+            for _ in rows:
+                self._slots.release()
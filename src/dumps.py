@@ -0,0 +1,276 @@
+"""
+Streaming import and export of messages history dumps.
+
+Dump is a JSON array of Telegram messages (`Message.to_dict()`) or JSON lines of them, gzip compressed if filename ends
+with `.gz`. Memory use does not depend on dump size in both directions.
+
+* Import: dump is parsed as a stream and every message is mapped straight to `MessageModel` row. Rows are written by
+`COPY` in chunks, every chunk is committed separately. Messages already stored (by chat and message id) are skipped.
+* Export: history payloads are read by server-side cursor in chunks and written as JSON lines.
+
+### CLI:
+
+>>> python src/dumps.py load path/to/dump.json --user-id 123
+>>> python src/dumps.py dump path/to/dump.jsonl.gz --storage-id 1
+"""
+
+import argparse
+import asyncio
+import gzip
+import io
+import json
+import os
+from contextlib import contextmanager
+from dataclasses import dataclass
+from pathlib import Path
+from typing import IO, Callable, Iterator
+
+from sqlalchemy import select, tuple_
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine
+
+from accessories import PayloadCodec
+from configurations import CONFIG, logger
+from database import MessageModel, UserModel, create_engine
+from database.models import (
+    MessagePayloadModel,
+    allocate_media_seqs,
+    allocate_message_ids,
+)
+
+CHUNK_SIZE = 1_000
+"""Amount of messages written (and committed) at once. """
+READ_SIZE = 1 << 20
+"""Amount of characters read from dump at once. """
+DUMP_CHUNK_SIZE = 1_000
+"""Amount of messages fetched by server-side cursor at once. """
+
+_SEPARATORS = ' \t\r\n,[]'
+_COLUMNS = (
+    'id',
+    'user_id',
+    'storage_id',
+    'chat_id',
+    'message_id',
+    'media_id',
+    'media_type',
+    'media_group_id',
+    'media_seq',
+    'is_media',
+)
+_PAYLOAD_COLUMNS = ('id', 'json', 'compressed')
+
+
+@contextmanager
+def open_dump(filepath: str | Path, mode: str = 'r') -> Iterator[tuple[IO[str], IO[bytes]]]:
+    """
+    Open dump as text, decompressing gzip. Underlying file is also provided to track read or written bytes.
+    """
+    with open(filepath, mode + 'b') as raw:
+        binary: IO[bytes] = gzip.GzipFile(fileobj=raw, mode=mode) if str(filepath).endswith('.gz') else raw
+        with io.TextIOWrapper(binary, encoding='utf-8') as file:
+            yield file, raw
+
+
+@dataclass
+class HistoryImportProgress:
+    read_bytes: int = 0
+    total_bytes: int = 0
+    imported: int = 0
+    skipped: int = 0
+    """Duplicated messages. """
+
+    def __str__(self) -> str:
+        percent = self.read_bytes / self.total_bytes * 100 if self.total_bytes else 100
+        return f'{percent:.0f}% read. Imported: {self.imported}. Skipped duplicates: {self.skipped}. '
+
+
+def iter_json_objects(file: IO[str], *, read_size: int = READ_SIZE) -> Iterator[dict]:
+    """
+    Decode JSON objects one by one from JSON array or JSON lines. Only the current object is kept in memory.
+    """
+    decoder = json.JSONDecoder()
+    buffer = ''
+    position = 0
+
+    while True:
+        while position < len(buffer) and buffer[position] in _SEPARATORS:
+            position += 1
+
+        try:
+            data, position = decoder.raw_decode(buffer, position)
+        except json.JSONDecodeError:
+            # object is not read completely:
+            chunk = file.read(read_size)
+            if not chunk:
+                if buffer[position:].strip(_SEPARATORS):
+                    raise
+                return
+
+            buffer = buffer[position:] + chunk
+            position = 0
+            continue
+
+        yield data
+
+
+async def load_history(
+    engine: AsyncEngine,
+    filepath: str | Path,
+    *,
+    user_id: int,
+    storage_id: int,
+    chunk_size: int = CHUNK_SIZE,
+    read_size: int = READ_SIZE,
+    progress: Callable[[HistoryImportProgress], None] | None = None,
+    codec: PayloadCodec | None = None,
+) -> HistoryImportProgress:
+    """
+    Import messages from dump to user history. Payloads are stored by `codec` (configured one by default).
+    """
+    codec = codec or CONFIG.history_payload_codec
+    summary = HistoryImportProgress(total_bytes=os.path.getsize(filepath))
+
+    with open_dump(filepath) as (file, raw):
+        chunk: list[dict] = []
+        for data in iter_json_objects(file, read_size=read_size):
+            chunk.append(MessageModel.get_values(data, user_id=user_id, storage_id=storage_id, codec=codec))
+            if len(chunk) < chunk_size:
+                continue
+
+            await _write_chunk(engine, chunk, summary)
+            summary.read_bytes = raw.tell()
+            logger.info(f'Load history: {summary}')
+            if progress:
+                progress(summary)
+            chunk = []
+
+        if chunk:
+            await _write_chunk(engine, chunk, summary)
+        summary.read_bytes = summary.total_bytes
+
+    logger.info(f'Load history is done: {summary}')
+    return summary
+
+
+async def _write_chunk(engine: AsyncEngine, chunk: list[dict], summary: HistoryImportProgress):
+    async with engine.begin() as connection:
+        rows = await _exclude_duplicates(connection, chunk)
+        await allocate_media_seqs(connection, rows)
+        await allocate_message_ids(connection, rows)
+
+        records = [tuple(row.get(column) for column in _COLUMNS) for row in rows]
+        payloads = [(row['id'], _encode_json(row['payload']['json']), row['payload']['compressed']) for row in rows]
+
+        driver_connection = (await connection.get_raw_connection()).driver_connection
+        await driver_connection.copy_records_to_table(  # type: ignore[union-attr]
+            MessageModel.__tablename__, records=records, columns=_COLUMNS
+        )
+        await driver_connection.copy_records_to_table(  # type: ignore[union-attr]
+            MessagePayloadModel.__tablename__, records=payloads, columns=_PAYLOAD_COLUMNS
+        )
+
+    summary.imported += len(rows)
+    summary.skipped += len(chunk) - len(rows)
+
+
+def _encode_json(data: dict | None):
+    return json.dumps(data) if data is not None else None
+
+
+async def _exclude_duplicates(connection: AsyncConnection, chunk: list[dict]):
+    keys = {(row['chat_id'], row['message_id']) for row in chunk}
+    query = select(MessageModel.chat_id, MessageModel.message_id).filter(
+        tuple_(MessageModel.chat_id, MessageModel.message_id).in_(keys)
+    )
+    stored = set((await connection.execute(query)).tuples().all())
+
+    rows = []
+    for row in chunk:
+        key = (row['chat_id'], row['message_id'])
+        if key not in stored:
+            stored.add(key)  # duplicates inside the chunk itself
+            rows.append(row)
+    return rows
+
+
+async def dump_history(
+    engine: AsyncEngine,
+    filepath: str | Path,
+    *,
+    user_id: int | None = None,
+    storage_id: int | None = None,
+    chunk_size: int = DUMP_CHUNK_SIZE,
+) -> int:
+    """
+    Export user or storage history (all history if none is provided) in the shape `load_history` accepts.
+    Return amount of exported messages.
+    """
+    query = (
+        select(MessagePayloadModel.json, MessagePayloadModel.compressed)
+        .join(MessageModel, MessageModel.id == MessagePayloadModel.id)
+        .order_by(MessagePayloadModel.id)
+        .execution_options(yield_per=chunk_size)
+    )
+    if user_id is not None:
+        query = query.filter(MessageModel.user_id == user_id)
+    if storage_id is not None:
+        query = query.filter(MessageModel.storage_id == storage_id)
+
+    amount = 0
+    # the same snapshot for all chunks, so export is consistent while bot is writing history
+    with open_dump(filepath, 'w') as (file, raw):
+        async with engine.connect() as connection:
+            await connection.execution_options(isolation_level='REPEATABLE READ')
+            result = await connection.stream(query)
+            async for partition in result.partitions():
+                file.writelines(
+                    json.dumps(MessagePayloadModel.decode(data, compressed)) + '\n' for data, compressed in partition
+                )
+                amount += len(partition)
+                logger.info(f'Dump history: {amount} messages. ')
+
+    logger.info(f'Dump history is done: {amount} messages. ')
+    return amount
+
+
+async def main(args: argparse.Namespace):
+    engine = create_engine(CONFIG)
+    try:
+        if args.command == 'dump':
+            await dump_history(
+                engine, args.filepath, user_id=args.user_id, storage_id=args.storage_id, chunk_size=args.chunk_size
+            )
+            return
+
+        if args.user_id is None:
+            raise SystemExit('History owner is not provided: set --user-id or ADMIN_ID. ')
+
+        async with engine.connect() as connection:
+            query = select(UserModel.storage_id).filter(UserModel.id == args.user_id)
+            storage_id = (await connection.execute(query)).scalar_one_or_none()
+        if storage_id is None:
+            raise SystemExit(f'No user {args.user_id}. User must start conversation with bot before. ')
+
+        await load_history(
+            engine, args.filepath, user_id=args.user_id, storage_id=storage_id, chunk_size=args.chunk_size
+        )
+    finally:
+        await engine.dispose()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Messages history dumps. ')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    load_parser = subparsers.add_parser('load', help='Import messages from dump to user history. ')
+    load_parser.add_argument('filepath', type=Path)
+    load_parser.add_argument('--user-id', type=int, default=CONFIG.admin_id, help='History owner (admin by default). ')
+    load_parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE)
+
+    dump_parser = subparsers.add_parser('dump', help='Export messages history to JSON lines (gzip for ".gz"). ')
+    dump_parser.add_argument('filepath', type=Path)
+    dump_parser.add_argument('--user-id', type=int)
+    dump_parser.add_argument('--storage-id', type=int)
+    dump_parser.add_argument('--chunk-size', type=int, default=DUMP_CHUNK_SIZE)
+
+    asyncio.run(main(parser.parse_args()))
@@ -1,11 +1,14 @@
 """
 Enterpoint for handling Telegram bot updates by long polling.
 """
-from application import app
+from application.application import get_app, get_builder, polling_init
 from configurations import CONFIG, logger
 
 
 def main() -> None:
+    get_builder().post_init(polling_init)
+    app = get_app()
+
     logger.debug(f'Start {CONFIG.botname} polling under: {CONFIG}. Listening for updates...')
     app.run_polling()
 
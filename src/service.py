@@ -1,16 +1,38 @@
+import random
 from dataclasses import dataclass
+from datetime import datetime
+from itertools import product
+from typing import Iterable, Literal
+from zoneinfo import ZoneInfo
 
-from sqlalchemy import func, select
+from sqlalchemy import (
+    BIGINT,
+    delete,
+    event,
+    false,
+    func,
+    select,
+    true,
+    union_all,
+    update,
+)
+from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.exc import NoResultFound
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy.orm import selectinload
+from sqlalchemy.orm import aliased, contains_eager, selectinload
 from telegram import User
 from telegram._message import Message
 
 from accessories import MediaType
-from configurations import logger
-from database import MessageModel
-from database.models import StorageModel, UserModel
+from configurations import CONFIG, logger
+from database import HistoryWriter, MembershipCache, MessageModel
+from database.models import (
+    MediaCounterModel,
+    MessagePayloadModel,
+    StorageModel,
+    SubscriptionModel,
+    UserModel,
+)
 from exceptions import NoPhotosException, NoUserException
 
 
@@ -25,6 +47,10 @@ class AppService:
     """Effective user from DB (accessing telegram object via `user.tg`). """
     message: Message
     """Message from telegram update. """
+    writer: HistoryWriter | None = None
+    """Write-behind history recorder. History is added to session if not provided. """
+    cache: MembershipCache | None = None
+    """Users with their storage membership. Users are taken from DB every time if not provided. """
 
     async def get_user(self, user: User | int | None):
         """
@@ -34,68 +60,420 @@ class AppService:
             raise ValueError(user)
 
         user_id = user.id if isinstance(user, User) else user
-        options = (
-            selectinload(UserModel.storage).selectinload(StorageModel.requests),
-            selectinload(UserModel.storage).selectinload(StorageModel.participants),
+        if not (result := await self._get_cached_user(user_id)):
+            options = selectinload(UserModel.storage).selectinload(StorageModel.requests)
+            query = select(UserModel).filter_by(id=user_id).options(options)
+            try:
+                result = (await self.session.execute(query)).unique().scalar_one()
+            except NoResultFound:
+                raise NoUserException()
+
+            if self.cache is not None:
+                self.cache.put(result)
+
+        if isinstance(user, User):
+            result.tg = user
+        return result
+
+    async def get_or_create_user(self, user: User) -> UserModel:
+        """
+        Get user from DB or create it along with its default storage (see `UserModel.__post_init__`). User is loaded
+        with storage and storage requests by a single statement:
+
+        * storage and user are inserted by CTEs (`INSERT ... ON CONFLICT DO NOTHING`), so concurrent first messages
+        do not fail on unique violation;
+        * inserted rows are not visible for the statement itself, therefore they are taken from `RETURNING`.
+        """
+        if cached := await self._get_cached_user(user.id):
+            cached.tg = user
+            return cached
+
+        new_storage = (
+            insert(StorageModel)
+            .values(id=user.id)
+            .on_conflict_do_nothing()
+            .returning(*StorageModel.__table__.c)
+            .cte('new_storage')
+        )
+        new_user = (
+            insert(UserModel)
+            .values(id=user.id, storage_id=user.id)
+            .on_conflict_do_nothing()
+            .returning(*UserModel.__table__.c)
+            .cte('new_user')
         )
-        query = select(UserModel).filter_by(id=user_id).options(*options)
+        users = union_all(
+            select(*UserModel.__table__.c, false().label('created')).filter(UserModel.id == user.id),
+            select(*new_user.c, true().label('created')),
+        ).subquery('users')
+        storages = union_all(select(*StorageModel.__table__.c), select(*new_storage.c)).subquery('storages')
 
-        try:
-            result = (await self.session.execute(query)).unique().scalar_one()
-            if isinstance(user, User):
-                result.tg = user
-            return result
-        except NoResultFound:
+        user_entity = aliased(UserModel, users)
+        storage_entity = aliased(StorageModel, storages)
+        request_entity = aliased(UserModel)
+        query = (
+            select(user_entity, users.c.created)
+            .join(storage_entity, user_entity.storage_id == storage_entity.id)
+            .outerjoin(request_entity, request_entity.storage_request_id == storage_entity.id)
+            .options(
+                contains_eager(user_entity.storage.of_type(storage_entity)).contains_eager(
+                    storage_entity.requests.of_type(request_entity)
+                )
+            )
+        )
+
+        # user inserted by concurrent transaction is not visible for this statement snapshot, so it is taken again:
+        for _ in range(2):
+            if row := (await self.session.execute(query)).unique().first():
+                break
+        else:
             raise NoUserException()
 
-    def append_history(self, message: Message):
-        media_id = None
-        media_type = None
+        result, created = row
+        if created:
+            logger.info(f'Add new user: {user.username}')
+        if self.cache is not None:
+            self.cache.put(result)
 
-        if message.photo:
-            media_id = message.photo[-1].file_id
-            media_type = MediaType.photo.value
-        elif message.video:
-            logger.warn('Add video type. It is experemental future. ')
-            media_id = message.video.file_id
-            media_type = MediaType.video.value
+        result.tg = user
+        return result
 
-        instance = MessageModel(
-            user_id=self.user.id,
-            message_id=message.message_id,
-            media_id=media_id,
-            media_type=media_type,
-            media_group_id=message.media_group_id,
-            json=message.to_dict(),
+    async def _get_cached_user(self, user_id: int) -> UserModel | None:
+        if self.cache is None or not (cached := self.cache.get(user_id)):
+            return None
+        return await self.session.merge(cached, load=False)
+
+    def invalidate_membership(self, *, user_ids: tuple[int, ...] = (), storage_ids: tuple[int, ...] = ()):
+        """
+        Forget cached users, which storage membership is changed. Users are forgotten at once and after commit again,
+        so concurrent updates do not cache not committed state.
+        """
+        if self.cache is None:
+            return
+
+        cache = self.cache
+        cache.invalidate(user_ids=user_ids, storage_ids=storage_ids)
+        event.listen(
+            self.session.sync_session,
+            'after_commit',
+            lambda session: cache.invalidate(user_ids=user_ids, storage_ids=storage_ids),
+            once=True,
         )
 
+    async def subscribe(self, timezone: str = 'UTC') -> SubscriptionModel:
+        """
+        Subscribe user to feed me messages (or change subscription time zone). Default schedule is taken by user id,
+        so messages are spread over the day (see `AppConfig.get_feed_me_cron`).
+
+        Raise `ZoneInfoNotFoundError` (`KeyError`) or `ValueError` for invalid time zone.
+        """
+        ZoneInfo(timezone)
+        subscription = await self.session.scalar(select(SubscriptionModel).filter_by(user_id=self.user.id))
+        if not subscription:
+            subscription = SubscriptionModel(user_id=self.user.id, cron=CONFIG.get_feed_me_cron(self.user.id))
+            self.session.add(subscription)
+
+        subscription.timezone = timezone
+        subscription.schedule()
+        return subscription
+
+    async def unsubscribe(self) -> bool:
+        result = await self.session.execute(delete(SubscriptionModel).filter_by(user_id=self.user.id))
+        return bool(result.rowcount)
+
+    async def claim_due_subscriptions(self, *, limit: int, now: datetime | None = None) -> list[int]:
+        """
+        Take due subscriptions and reschedule them. Return subscribed users ids.
+
+        Rows are locked with `SKIP LOCKED`, so concurrent schedulers take different subscriptions. Runs missed while
+        scheduler was down are not repeated: subscription is rescheduled after current time.
+        """
+        now = now or datetime.utcnow()
+        query = (
+            select(SubscriptionModel)
+            .filter(SubscriptionModel.next_run_at <= now)
+            .order_by(SubscriptionModel.next_run_at)
+            .limit(limit)
+            .with_for_update(skip_locked=True)
+        )
+        subscriptions = (await self.session.scalars(query)).all()
+        for subscription in subscriptions:
+            subscription.schedule(now)
+        return [subscription.user_id for subscription in subscriptions]
+
+    async def record_history(self, message: Message):
+        """
+        Record message to history by write-behind writer or append it to session (if writer is not used).
+        """
+        if not self.writer:
+            return self.append_history(message)
+
+        values = self._get_history_values(message)
+        logger.debug(f'Queue message {values["message_id"]} to history. ')
+        await self.writer.put(values, session=self.session)
+        return None
+
+    def append_history(self, message: Message):
+        values = self._get_history_values(message)
+        payload = MessagePayloadModel(**values.pop('payload'))
+        instance = MessageModel(**values, payload=payload)
+
         logger.debug(f'Append {instance} to history. ')
         self.session.add(instance)
         return instance
 
-    async def get_media_id(self, *, media_type: MediaType | None = None):
-        query = self._get_media_query(media_type).order_by(func.random()).limit(1)
+    def _get_history_values(self, message: Message):
+        if message.video:
+            logger.warn('Add video type. It is experemental future. ')
+
+        return MessageModel.get_values(
+            message.to_dict(),
+            user_id=self.user.id,
+            storage_id=self.user.storage_id,
+            codec=CONFIG.history_payload_codec,
+        )
+
+    async def get_media_id(self, *, media_type: MediaType | None = None) -> str:
+        """
+        Get random media from user storage. Media is taken by its position (`MessageModel.media_seq`), so it costs an
+        index lookup regardless of storage size. Every media has the same chance to be taken.
+        """
+        counters = await self._get_media_counters(media_type)
+        if not (total := sum(counters.values())):
+            raise NoPhotosException()
+
+        # choose media type weighted by its amount and then position among that type media:
+        position = random.randrange(total)
+        for media_type_value, count in sorted(counters.items()):
+            if position < count:
+                break
+            position -= count
+
+        query = self._get_media_position_query(media_type_value, position)
+        if media_id := (await self.session.execute(query)).scalar():
+            return media_id
+
+        logger.warning(f'No media at position {position}. Rebuild media index for storage {self.user.storage_id}. ')
+        await self.rebuild_media_index(self.user.storage_id)
 
+        query = self._get_media_query(media_type).with_only_columns(MessageModel.media_id).order_by(func.random())
         try:
-            message = (await self.session.execute(query)).scalar_one()
+            return (await self.session.execute(query.limit(1))).scalar_one()
         except NoResultFound:
             raise NoPhotosException()
 
-        assert message.media_id
-        return message.media_id
+    async def get_users_media_ids(
+        self, user_ids: Iterable[int], *, media_type: MediaType | None = None
+    ) -> dict[int, str | None]:
+        """
+        Get random media from storages of many users by a single query (the same way as `get_media_id`): position is
+        taken by storage counters and media is found by index lookup. Missing users are omitted, `None` is for users
+        without media (or storages without counters, use `get_media_id` for them).
+        """
+        types = self._get_media_types(media_type)
+        user_ids = list(user_ids)
+        storage_ids = select(UserModel.storage_id).filter(UserModel.id.in_(user_ids))
+        filters = (MediaCounterModel.storage_id.in_(storage_ids), MediaCounterModel.media_type.in_(types))
+
+        # media types positions ranges [start, start + count) at storage:
+        counters = (
+            select(
+                MediaCounterModel.storage_id,
+                MediaCounterModel.media_type,
+                MediaCounterModel.count,
+                (
+                    func.sum(MediaCounterModel.count).over(
+                        partition_by=MediaCounterModel.storage_id, order_by=MediaCounterModel.media_type
+                    )
+                    - MediaCounterModel.count
+                )
+                .cast(BIGINT)
+                .label('start'),
+            )
+            .filter(*filters)
+            .subquery('counters')
+        )
+        # sum() is numeric and random() is double, cast to compare with indexed media_seq:
+        positions = (
+            select(
+                MediaCounterModel.storage_id,
+                func.floor(func.random() * func.sum(MediaCounterModel.count)).cast(BIGINT).label('position'),
+            )
+            .filter(*filters)
+            .group_by(MediaCounterModel.storage_id)
+            .having(func.sum(MediaCounterModel.count) > 0)
+            .subquery('positions')
+        )
+        media_id = (
+            select(MessageModel.media_id)
+            .filter(
+                MessageModel.storage_id == counters.c.storage_id,
+                MessageModel.media_type == counters.c.media_type,
+                MessageModel.media_seq == positions.c.position - counters.c.start,
+                MessageModel.media_id.isnot(None),
+                MessageModel.is_media.is_(True),  # non-media partitions are pruned
+            )
+            .limit(1)
+            .scalar_subquery()
+        )
+        query = (
+            select(UserModel.id, media_id)
+            .outerjoin(positions, positions.c.storage_id == UserModel.storage_id)
+            .outerjoin(
+                counters,
+                (counters.c.storage_id == positions.c.storage_id)
+                & (counters.c.start <= positions.c.position)
+                & (positions.c.position < counters.c.start + counters.c.count),
+            )
+            .filter(UserModel.id.in_(user_ids))
+        )
+        return dict((await self.session.execute(query)).tuples().all())
+
+    async def get_media_count(self, *, media_type: MediaType | None = None, queued: bool = True) -> int:
+        """
+        Get media amount at user storage. Taken from maintained counters, so it does not depend on history size.
+
+        `queued`: count media queued by history writer as well.
+        """
+        if not self.writer or not queued:
+            return sum((await self._get_media_counters(media_type)).values())
+
+        types = self._get_media_types(media_type)
+        return await self.writer.count(
+            lambda row: row['storage_id'] == self.user.storage_id and row['media_id'] and row['media_type'] in types,
+            lambda: self.get_media_count(media_type=media_type, queued=False),
+            session=self.session,
+        )
+
+    async def _get_media_counters(self, media_type: MediaType | None = None) -> dict[str, int]:
+        types = self._get_media_types(media_type)
+        query = select(MediaCounterModel.media_type, MediaCounterModel.count).filter(
+            MediaCounterModel.storage_id == self.user.storage_id,
+            MediaCounterModel.media_type.in_(types),
+        )
+        counters: dict[str, int] = dict((await self.session.execute(query)).tuples().all())
+
+        if len(counters) < len(types):
+            # fallback for storages without counters:
+            counted = await self.refresh_media_counters(self.user.storage_id, on_conflict='ignore')
+            counters = {media_type: counted[self.user.storage_id, media_type] for media_type in types}
+
+        return counters
+
+    async def move_history(self, user_id: int, from_storage_id: int, to_storage_id: int):
+        """
+        Move user history to another storage along with him. Media positions of both storages are renumbered.
+        """
+        if self.writer:
+            await self.writer.flush()  # queued history is moved as well
+            for row in self.writer.get_session_rows(self.session):
+                if row['user_id'] == user_id and row['storage_id'] == from_storage_id:
+                    row['storage_id'] = to_storage_id
+        statement = (
+            update(MessageModel)
+            .filter(MessageModel.user_id == user_id, MessageModel.storage_id == from_storage_id)
+            .values(storage_id=to_storage_id)
+            .execution_options(synchronize_session=False)
+        )
+        await self.session.execute(statement)
+        await self.rebuild_media_index(from_storage_id, to_storage_id)
 
-    async def get_media_count(self, *, media_type: MediaType | None = None):
-        query = self._get_media_query(media_type)
-        return len((await self.session.execute(query)).all())  # FIXME: SQL count
+    async def rebuild_media_index(self, *storage_ids: int):
+        """
+        Renumber storages media positions and refresh counters. Used when storage media is changed not by inserting,
+        for example, after storage participants are changed.
+        """
+        # lock counters, so inserts at other transactions are waiting for rebuilding:
+        query = select(MediaCounterModel.id).filter(MediaCounterModel.storage_id.in_(storage_ids)).with_for_update()
+        await self.session.execute(query)
 
-    def _get_media_query(self, media_type: MediaType | None = None):
-        types = [media_type.value] if media_type else [MediaType.photo.value, MediaType.video.value]
+        seq = func.row_number().over(
+            partition_by=(MessageModel.storage_id, MessageModel.media_type),
+            order_by=MessageModel.id,
+        )
+        ranked = (
+            self._get_media_query(storage_ids=storage_ids)
+            .with_only_columns(MessageModel.id, (seq - 1).label('seq'))
+            .subquery()
+        )
+        statement = (
+            update(MessageModel)
+            .filter(MessageModel.id == ranked.c.id, MessageModel.media_seq.is_distinct_from(ranked.c.seq))
+            .values(media_seq=ranked.c.seq)
+            .execution_options(synchronize_session=False)
+        )
+        await self.session.execute(statement)
+        await self.refresh_media_counters(*storage_ids)
+
+    async def refresh_media_counters(
+        self, *storage_ids: int, on_conflict: Literal['replace', 'ignore'] = 'replace'
+    ) -> dict[tuple[int, str], int]:
+        """
+        Count storages media by SQL query and store it to counters. Used as a fallback for storages without counters.
+        """
+        types = self._get_media_types()
+        query = (
+            self._get_media_query(storage_ids=storage_ids)
+            .with_only_columns(MessageModel.storage_id, MessageModel.media_type, func.count())
+            .group_by(MessageModel.storage_id, MessageModel.media_type)
+        )
+        counted = {
+            (storage_id, media_type): count for storage_id, media_type, count in await self.session.execute(query)
+        }
+        counters = {key: counted.get(key, 0) for key in product(storage_ids, types)}
+
+        values = [dict(storage_id=key[0], media_type=key[1], count=count) for key, count in counters.items()]
+        await self.session.execute(MediaCounterModel.upsert(values, on_conflict=on_conflict))
+
+        logger.debug(f'Refresh media counters: {counters}. ')
+        return counters
+
+    def _get_media_types(self, media_type: MediaType | None = None):
+        return [media_type.value] if media_type else [MediaType.photo.value, MediaType.video.value]
+
+    def _get_media_position_query(self, media_type: str, position: int):
+        """
+        Query for user storage media at provided position. Predicates match partial media index.
+        """
+        return (
+            select(MessageModel.media_id)
+            .filter(
+                MessageModel.storage_id == self.user.storage_id,
+                MessageModel.media_type == media_type,
+                MessageModel.media_seq == position,
+                MessageModel.media_id.isnot(None),
+                MessageModel.is_media.is_(True),  # non-media partitions are pruned
+            )
+            .limit(1)
+        )
+
+    def _get_media_query(self, media_type: MediaType | None = None, *, storage_ids: Iterable[int] = ()):
+        """
+        Query for media of provided storages (user storage by default).
+        """
         return select(MessageModel).filter(
-            MessageModel.user_id.in_(participant.id for participant in self.user.storage.participants),
-            MessageModel.media_type.in_(types),
+            MessageModel.storage_id.in_(storage_ids or [self.user.storage_id]),
+            MessageModel.media_type.in_(self._get_media_types(media_type)),
             MessageModel.media_id.isnot(None),
         )
 
-    async def get_history_count(self, *filters):
-        query = select(MessageModel).filter(MessageModel.user_id == self.user.id, *filters)
-        return len((await self.session.execute(query)).scalars().all())  # FIXME: SQL count
+    async def get_history_count(self, *filters) -> int:
+        query = select(func.count()).select_from(MessageModel).filter(MessageModel.user_id == self.user.id, *filters)
+        return (await self.session.execute(query)).scalar_one()
+
+    async def get_media_group_count(self, media_group_id: str) -> int:
+        """
+        Amount of user messages of media group (including queued by history writer).
+        """
+
+        async def query():
+            return await self.get_history_count(MessageModel.media_group_id == media_group_id)
+
+        if not self.writer:
+            return await query()
+
+        return await self.writer.count(
+            lambda row: row['user_id'] == self.user.id and row['media_group_id'] == media_group_id,
+            query,
+            session=self.session,
+        )
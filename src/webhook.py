@@ -1,22 +1,107 @@
 """
 Enterpoint for Yandex.Cloud function calls which used as webhook for Telegram.
 """
+import asyncio
+import atexit
 import json
+import signal
 import sys
+import time
 from pathlib import Path
 from typing import TypeAlias
 
-from telegram import Update
-
 sys.path.append(str(Path(__file__).resolve().parent))
 
-from application import app  # noqa: E402
+from application import get_app  # noqa: E402
 from configurations import CONFIG, logger  # noqa: E402
 
 _RuntimeContext: TypeAlias = object
 """Special yandex.cloud functions object. """
 
 
+_loop: asyncio.AbstractEventLoop | None = None
+"""Event loop application was started at. Connections pools and http client are bound to it. """
+_startup_lock: asyncio.Lock | None = None
+_post_initialized = False
+"""Middlewares, handlers and tasks are registered once, even if application is restarted. """
+_jobs_ticked_at: float | None = None
+"""Monotonic time scheduled jobs were ticked at (by invocation, as function is not running between them). """
+
+
+async def startup():
+    """
+    Initialize application once per container. Next invocations reuse running application, its pools and caches.
+    """
+    global _loop, _startup_lock, _post_initialized
+
+    app = get_app()
+    loop = asyncio.get_running_loop()
+    if _loop is not loop:
+        if app.running:
+            logger.warning('Event loop is changed between invocations. Restart application. ')
+            await shutdown()
+        _loop, _startup_lock = loop, asyncio.Lock()
+        _register_shutdown_hooks(loop)
+
+    assert _startup_lock
+    async with _startup_lock:
+        if app.running:
+            return
+
+        logger.info(f'Start {CONFIG.botname} application. ')
+        await app.initialize()
+        if app.post_init and not _post_initialized:
+            await app.post_init(app)
+            _post_initialized = True
+        await app.start()
+
+
+async def shutdown():
+    if not _loop or not (app := get_app()).running:
+        return
+
+    logger.info(f'Stop {CONFIG.botname} application. ')
+    try:
+        await app.stop()
+    finally:
+        await app.shutdown()
+
+
+async def tick_jobs():
+    """
+    Execute due scheduled jobs (history partitions maintenance, etc.) by invocations, not more often than
+    `CONFIG.scheduler_interval`. Runs missed between invocations are executed at the next tick.
+    """
+    global _jobs_ticked_at
+
+    now = time.monotonic()
+    if _jobs_ticked_at is not None and now - _jobs_ticked_at < CONFIG.scheduler_interval:
+        return
+    _jobs_ticked_at = now
+
+    from application.application import get_job_scheduler
+
+    try:
+        await get_job_scheduler(get_app()).tick()
+    except Exception as e:
+        logger.exception(f'Scheduled jobs are not ticked: {e!r}')
+
+
+def _register_shutdown_hooks(loop: asyncio.AbstractEventLoop):
+    # container is stopped by runtime with SIGTERM, graceful shutdown is run at event loop
+    try:
+        loop.add_signal_handler(signal.SIGTERM, lambda: loop.create_task(shutdown()))
+    except (NotImplementedError, RuntimeError):
+        logger.warning('SIGTERM handler is not supported. Application is stopped at exit only. ')
+
+    atexit.register(_shutdown_at_exit, loop)
+
+
+def _shutdown_at_exit(loop: asyncio.AbstractEventLoop):
+    if get_app().running and not loop.is_closed() and not loop.is_running():
+        loop.run_until_complete(shutdown())
+
+
 async def gateway(event: dict, context: _RuntimeContext):
     # NOTE
     # depending on Yandex.Functions settings, request body could be not parsed yet
@@ -24,12 +109,15 @@ async def gateway(event: dict, context: _RuntimeContext):
     if isinstance(data, str):
         data = json.loads(data)
 
+    # NOTE: telegram (and all application dependencies) are imported at first invocation, not at cold start
+    from telegram import Update
+
     try:
-        logger.info(f'Handle update for {CONFIG.botname}. Start app. ')
-        if not app.running:
-            await app.initialize()
-            await app.start()
+        logger.info(f'Handle update for {CONFIG.botname}. ')
+        await startup()
+        app = get_app()
         await app.process_update(Update.de_json(data=data, bot=app.bot))
+        await tick_jobs()
     except:  # noqa: E722
         # TODO
         # special handling
@@ -40,9 +128,8 @@ async def gateway(event: dict, context: _RuntimeContext):
             'body': 'Proceeded successfully. ',
         }
     finally:
-        logger.info('Stop application. ')
-        await app.stop()
-        await app.shutdown()
+        if not CONFIG.webhook_warm:
+            await shutdown()
 
 
 # TODO
@@ -18,6 +18,7 @@ pytest_plugins = [
     'tests.fixtures.fixture_config',
     'tests.fixtures.fixture_db',
     'tests.fixtures.fixture_images',
+    'tests.fixtures.fixture_messages',
     'tests.fixtures.fixture_users',
 ]
 
@@ -7,7 +7,7 @@ from tests.conftest import logger
 
 
 @pytest.fixture(scope='session')
-async def application(config: AppConfig):
+async def application(config: AppConfig, setup_database: None):
     builder = (
         LayeredApplication.builder()
         #
@@ -18,6 +18,8 @@ async def application(config: AppConfig):
         .token(config.bot_token.get_secret_value() + '/test')
         .context_types(NoneContextType)
         .application_class(LayeredApplication)
+        .concurrent_updates(config.update_pending_max)
+        .job_queue(None)
         .post_init(app_init)
     )
 
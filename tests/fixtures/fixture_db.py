@@ -21,6 +21,7 @@ async def setup_database(engine: AsyncEngine):
 
     yield
     logger.debug(f'Tear down test database: {engine.pool.status()}. ')
+    await engine.dispose()  # pooled connections prevent database from dropping
 
     if database_exists(url):
         drop_database(url)
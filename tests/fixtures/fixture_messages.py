@@ -0,0 +1,30 @@
+from datetime import datetime
+from itertools import count
+from typing import Callable
+
+import pytest
+from telegram import Chat, Message, PhotoSize, User
+
+from utils import randstr
+
+_message_ids = count(1)
+
+
+@pytest.fixture
+def make_message() -> Callable[..., Message]:
+    """
+    Factory of Telegram messages sent by provided user. Message has photo attached if `photo` is True.
+    """
+
+    def factory(tg_user: User, *, photo: bool = False, media_group_id: str | None = None, text: str = ''):
+        return Message(
+            message_id=next(_message_ids),
+            date=datetime.now(),
+            chat=Chat(tg_user.id, Chat.PRIVATE),
+            from_user=tg_user,
+            text=text or None,
+            photo=[PhotoSize(randstr(), randstr(), 90, 90)] if photo else None,
+            media_group_id=media_group_id,
+        )
+
+    return factory
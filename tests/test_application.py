@@ -0,0 +1,147 @@
+import asyncio
+
+import pytest
+from telegram import Chat, Message, Update, User
+from telegram.ext import ConversationHandler, MessageHandler, filters
+
+from application.base import APPHandlers, LayeredApplication, TextDispatchHandler
+from application.middlewares import Dependency
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_update_lanes(setup_database: None):
+    handled: list[tuple[int, int]] = []
+
+    async def handler(update: Update, context):
+        await asyncio.sleep(0.1 if update.update_id == 1 else 0)  # the first update is the slowest one
+        handled.append((update.effective_user.id, update.update_id))
+
+    app = LayeredApplication.builder().token('123:test').application_class(LayeredApplication).build()
+    app.add_handler(MessageHandler(filters.ALL, handler))
+    app.bot._initialized = True  # do not request `getMe`
+    await app.initialize()
+
+    def make_update(update_id: int, user_id: int):
+        user = User(user_id, 'user', False)
+        return Update(update_id, message=Message(update_id, None, Chat(user_id, 'private'), from_user=user))
+
+    lanes = len(app._lanes)
+    updates = [make_update(1, 1), make_update(2, 1), make_update(3, 2), make_update(4, 1 + lanes)]
+    await asyncio.gather(*(app.process_update(update) for update in updates))
+
+    # another user is not stalled by the slow one, while updates of the same user (lane) keep their order:
+    assert handled == [(2, 3), (1, 1), (1, 2), (1 + lanes, 4)]
+
+    await app.shutdown()
+
+
+async def test_update_lanes_slots(setup_database: None):
+    released = asyncio.Event()
+    handled: list[int] = []
+
+    async def handler(update: Update, context):
+        if update.effective_user.id == 1:
+            await released.wait()
+        handled.append(update.effective_user.id)
+
+    app = (
+        LayeredApplication.builder()
+        .token('123:test')
+        .application_class(LayeredApplication)
+        .concurrent_updates(2)
+        .build()
+    )
+    app.add_handler(MessageHandler(filters.ALL, handler))
+    app.bot._initialized = True  # do not request `getMe`
+    await app.initialize()
+    await app.start()
+
+    def make_update(update_id: int, user_id: int):
+        user = User(user_id, 'user', False)
+        return Update(update_id, message=Message(update_id, None, Chat(user_id, 'private'), from_user=user))
+
+    # lane of the first user is saturated by more updates than concurrent updates slots:
+    for update_id in range(4):
+        await app.update_queue.put(make_update(update_id, 1))
+    await app.update_queue.put(make_update(4, 2))
+
+    # updates waiting for the busy lane do not take slots of other lanes:
+    await asyncio.sleep(0.1)
+    assert handled == [2]
+
+    released.set()
+    await asyncio.wait_for(app.update_queue.join(), 1)
+    assert handled == [2, 1, 1, 1, 1]
+
+    await app.stop()
+    await app.shutdown()
+
+
+async def test_text_dispatch(setup_database: None):
+    handler = APPHandlers()
+
+    @handler.command(requires=Dependency.NONE)
+    async def start(message: Message):
+        ...
+
+    @handler.message(filters.Regex('🥛'), requires=Dependency.NONE, texts=['🥛', 'Milk'])
+    async def food(message: Message):
+        ...
+
+    @handler.message(requires=Dependency.NONE)
+    async def all(message: Message):
+        ...
+
+    app = LayeredApplication.builder().token('123:test').application_class(LayeredApplication).build()
+    app.add_handlers(handler)
+
+    # dispatcher is placed in front of the first indexed handler:
+    start_handler, dispatcher, food_handler, all_handler = app.handlers[0]
+    assert isinstance(dispatcher, TextDispatchHandler)
+    assert food_handler is handler['food']
+
+    def make_update(text: str):
+        return Update(1, message=Message(1, None, Chat(1, 'private'), text=text))  # type: ignore[arg-type]
+
+    assert dispatcher.check_update(make_update(' milk'))[0] is food_handler
+    assert dispatcher.check_update(make_update('milk please')) is None
+    assert dispatcher.check_update(make_update('/start')) is None
+
+    # not exact texts are still handled by regex:
+    assert food_handler.check_update(make_update('🥛🥛🥛'))
+    assert food_handler.check_update(make_update('MILK'))
+    assert not food_handler.check_update(make_update('milk please'))
+
+    # indexed handler is checked and handled as usual:
+    app.bot._initialized = True  # do not request `getMe`
+    await app.initialize()
+    dispatcher.index['milk'] = MessageHandler(filters.ChatType.GROUPS, food_handler.callback, block=False)
+    assert dispatcher.check_update(make_update('milk')) is None
+
+    handled = []
+
+    async def milk(update: Update, context):
+        handled.append(update)
+
+    dispatcher.index['milk'] = MessageHandler(filters.ChatType.PRIVATE, milk, block=False)
+    update = make_update('milk')
+    await app.start()
+    await app.process_update(update)
+    await asyncio.sleep(0)  # not blocking handler is handled by task
+    assert handled == [update]
+    await app.stop()
+    await app.shutdown()
+
+    # handlers of conversations could not be indexed:
+    handler = APPHandlers()
+
+    @handler.message(filters.TEXT, requires=Dependency.NONE, texts=['Yes'])
+    async def confirm(message: Message):
+        ...
+
+    handler.append(ConversationHandler([handler['confirm']], {}, []), handler_name='conversation')
+    with pytest.raises(ValueError):
+        LayeredApplication.builder().token('123:test').application_class(LayeredApplication).build().add_handlers(
+            handler
+        )
@@ -0,0 +1,120 @@
+"""
+Microbenchmarks for per update overhead. Run them alone with:
+
+>>> pytest tests/test_benchmarks.py -m benchmark -s
+"""
+
+import subprocess
+import sys
+import time
+from contextlib import asynccontextmanager
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+from telegram import Update
+
+from application.base import compile_middleware
+from application.context import CustomContext
+from application.middlewares import HandlerCallback
+from tests.conftest import logger
+
+pytestmark = [pytest.mark.anyio, pytest.mark.benchmark]
+
+UPDATES_AMOUNT = 20_000
+MIDDLEWARES_AMOUNT = 5
+
+WEBHOOK_IMPORT_BUDGET_USEC = 300_000
+WEBHOOK_DEFERRED_IMPORTS = ('telegram', 'sqlalchemy', 'apscheduler', 'yaml')
+"""Heavy subsystems which are imported at first webhook invocation, not at cold start. """
+
+
+@asynccontextmanager
+async def legacy_middleware(update: Update, context: CustomContext):
+    context.calls += 1
+    yield
+
+
+async def native_middleware(call_next: HandlerCallback, update: Update, context: CustomContext):
+    context.calls += 1
+    return await call_next(update, context)
+
+
+async def handler(update: Update, context: CustomContext):
+    return context.calls
+
+
+def wrap_per_update(middlewares: list, update: Update, context: CustomContext):
+    """Former way: context manager chain is rebuilt for every update."""
+    layer = handler
+    for middleware in reversed(middlewares):
+        layer = middleware(update, context).__call__(layer)
+    return layer
+
+
+def compile_once(middlewares: list):
+    layer = handler
+    for middleware in reversed(middlewares):
+        layer = compile_middleware(middleware, layer)
+    return layer
+
+
+async def test_compiled_middlewares_overhead():
+    update = Update(1)
+    context = SimpleNamespace(calls=0)
+    legacy = [legacy_middleware] * MIDDLEWARES_AMOUNT
+
+    # compiled pipeline is compatible with legacy middlewares and the same for every update:
+    assert await compile_once(legacy)(update, context) == MIDDLEWARES_AMOUNT
+    assert await compile_once([native_middleware] * MIDDLEWARES_AMOUNT)(update, context) == MIDDLEWARES_AMOUNT * 2
+
+    start = time.perf_counter()
+    for _ in range(UPDATES_AMOUNT):
+        await wrap_per_update(legacy, update, context)(update, context)
+    per_update_wrapping = time.perf_counter() - start
+
+    pipeline = compile_once(legacy)
+    start = time.perf_counter()
+    for _ in range(UPDATES_AMOUNT):
+        await pipeline(update, context)
+    compiled_legacy = time.perf_counter() - start
+
+    pipeline = compile_once([native_middleware] * MIDDLEWARES_AMOUNT)
+    start = time.perf_counter()
+    for _ in range(UPDATES_AMOUNT):
+        await pipeline(update, context)
+    compiled_native = time.perf_counter() - start
+
+    logger.info(
+        f'{MIDDLEWARES_AMOUNT} middlewares per update (usec): '
+        f'rebuilt per update {per_update_wrapping / UPDATES_AMOUNT * 1e6:.1f}, '
+        f'compiled legacy {compiled_legacy / UPDATES_AMOUNT * 1e6:.1f}, '
+        f'compiled native {compiled_native / UPDATES_AMOUNT * 1e6:.1f}'
+    )
+    assert compiled_native < per_update_wrapping
+
+
+def test_webhook_import_time():
+    src = Path(__file__).resolve().parent.parent / 'src'
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'import webhook'],
+        cwd=src,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+
+    # lines format: "import time: self [us] | cumulative | imported package"
+    cumulative: dict[str, int] = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, total, module = line.removeprefix('import time:').split('|')
+        cumulative[module.strip()] = int(total)
+
+    slowest = sorted(cumulative.items(), key=lambda item: item[1], reverse=True)[:10]
+    logger.info(f'webhook import time (usec): {cumulative["webhook"]}. Slowest modules: {slowest}')
+
+    assert not [module for module in cumulative if module.split('.')[0] in WEBHOOK_DEFERRED_IMPORTS]
+    assert 'application.application' not in cumulative
+    assert cumulative['webhook'] < WEBHOOK_IMPORT_BUDGET_USEC
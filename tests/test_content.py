@@ -0,0 +1,35 @@
+import shutil
+from pathlib import Path
+
+import pydantic
+import pytest
+
+from configurations import AppConfig
+from content import BotContent, Replyes, SendPhotoReplyes
+
+
+def test_content_snapshot(config: AppConfig, tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    filepath = tmp_path / 'content.yaml'
+    shutil.copy(config.content_filepath, filepath)
+    content = BotContent.parse_yaml(filepath)
+
+    # no snapshot: fallback to YAML
+    assert BotContent.load(filepath) == content
+
+    # snapshot is loaded without YAML parsing and without validation:
+    BotContent.dump_snapshot(filepath)
+    with monkeypatch.context() as patch:
+        patch.setattr(BotContent, 'parse_yaml', None)
+        patch.setattr(BotContent, 'parse_obj', None)
+        patch.setattr(Replyes, 'list_tranformation', None)
+        patch.setattr(pydantic.fields.ModelField, 'validate', None)
+        loaded = BotContent.load(filepath)
+
+    assert loaded == content
+    assert isinstance(loaded.messages.send_photo, SendPhotoReplyes)
+    assert isinstance(loaded.messages.regular, Replyes)
+    assert loaded.messages.regular.get() in content.messages.regular
+
+    # source is changed: snapshot is outdated
+    filepath.write_text(filepath.read_text().replace(content.messages.start, 'changed start message'))
+    assert BotContent.load(filepath).messages.start == 'changed start message'
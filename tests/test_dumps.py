@@ -0,0 +1,84 @@
+import gzip
+import io
+import json
+from pathlib import Path
+
+import pytest
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession
+from telegram import User
+
+from database.models import MessageModel, UserModel
+from dumps import dump_history, iter_json_objects, load_history
+
+pytestmark = pytest.mark.anyio
+
+
+def test_iter_json_objects():
+    objects = [{'id': i, 'text': '[{,}]' * i} for i in range(10)]
+
+    array = io.StringIO(json.dumps(objects, indent=2))
+    assert list(iter_json_objects(array, read_size=7)) == objects
+
+    lines = io.StringIO('\n'.join(map(json.dumps, objects)) + '\n')
+    assert list(iter_json_objects(lines, read_size=7)) == objects
+
+    with pytest.raises(json.JSONDecodeError):
+        list(iter_json_objects(io.StringIO('[{"id": 1}, {"id": '), read_size=7))
+
+
+async def test_load_history(engine: AsyncEngine, setup_tables: None, tg_user: User, make_message, tmp_path: Path):
+    async with AsyncSession(engine, expire_on_commit=False) as session, session.begin():
+        user = UserModel(tg=tg_user)
+        session.add(user)
+
+    messages = [make_message(tg_user, photo=True) for _ in range(5)] + [make_message(tg_user, text='hey')]
+    filepath = tmp_path / 'dump.json'
+    filepath.write_text(json.dumps([message.to_dict() for message in messages + messages[:2]]))
+
+    progress = []
+    summary = await load_history(
+        engine,
+        filepath,
+        user_id=user.id,
+        storage_id=user.storage_id,
+        chunk_size=3,
+        read_size=64,
+        progress=lambda summary: progress.append(summary.imported),
+    )
+    assert (summary.imported, summary.skipped) == (6, 2)
+    assert progress == [3, 6]
+
+    async with AsyncSession(engine) as session:
+        history = (await session.execute(select(MessageModel).order_by(MessageModel.message_id))).scalars().all()
+        assert [message.message_id for message in history] == [message.message_id for message in messages]
+        assert {message.chat_id for message in history} == {tg_user.id}
+        assert [message.media_seq for message in history if message.media_id] == [0, 1, 2, 3, 4]
+
+    # JSON lines dump with already loaded messages:
+    filepath = tmp_path / 'dump.jsonl'
+    filepath.write_text('\n'.join(json.dumps(message.to_dict()) for message in messages))
+    summary = await load_history(engine, filepath, user_id=user.id, storage_id=user.storage_id)
+    assert (summary.imported, summary.skipped) == (0, 6)
+
+
+async def test_dump_history(engine: AsyncEngine, setup_tables: None, tg_user: User, make_message, tmp_path: Path):
+    async with AsyncSession(engine, expire_on_commit=False) as session, session.begin():
+        user = UserModel(tg=tg_user)
+        session.add(user)
+
+    messages = [make_message(tg_user, photo=True) for _ in range(5)]
+    filepath = tmp_path / 'dump.json'
+    filepath.write_text(json.dumps([message.to_dict() for message in messages]))
+    await load_history(engine, filepath, user_id=user.id, storage_id=user.storage_id, codec='zlib')
+
+    filepath = tmp_path / 'dump.jsonl.gz'
+    assert await dump_history(engine, filepath, storage_id=user.storage_id, chunk_size=2) == 5
+    with gzip.open(filepath, 'rt') as file:
+        assert [json.loads(line) for line in file] == [message.to_dict() for message in messages]
+
+    assert await dump_history(engine, tmp_path / 'empty.jsonl', storage_id=user.storage_id + 1) == 0
+
+    # exported dump is accepted by import:
+    summary = await load_history(engine, filepath, user_id=user.id, storage_id=user.storage_id)
+    assert (summary.imported, summary.skipped) == (0, 5)
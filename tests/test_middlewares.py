@@ -1,8 +1,21 @@
+from types import SimpleNamespace
+
 import pytest
-from sqlalchemy.exc import NoResultFound
-from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select
+from sqlalchemy.exc import InvalidRequestError, NoResultFound
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession
+from telegram import Bot, Message, Update, User
 
+from application.base import LayeredApplication
+from application.middlewares import (
+    Dependency,
+    HandlerCallback,
+    args_middleware,
+    provides,
+    session_middleware,
+)
 from configurations import AppConfig
+from database.models import UserModel
 from tests.tools.integration import ClientIntegration
 
 pytestmark = pytest.mark.anyio
@@ -24,17 +37,115 @@ async def test_user_middleware(vybornyy: ClientIntegration, config: AppConfig, s
 
 
 async def test_history_middleware(vybornyy: ClientIntegration, config: AppConfig):
-    text = f'hey from {vybornyy.client.me.username}'
+    # chatter is not recorded to history:
+    async with vybornyy.collect():
+        await vybornyy.client.send_message(config.botname, f'hi from {vybornyy.client.me.username}')
+
+    assert not (await vybornyy.user).history
+
+    text = f'/start hey from {vybornyy.client.me.username}'
     async with vybornyy.collect():
         message = await vybornyy.client.send_message(config.botname, text)
 
     history = (await vybornyy.user).history
     assert len(history) == 1
 
+    # payload is stored separately and loaded explicitly:
+    with pytest.raises(InvalidRequestError):
+        history[-1].payload
+    await vybornyy.db_session.refresh(history[-1], ['payload'])
+    payload = history[-1].payload.data
+
     # NOTE
     # We could check messages ids, but the same message has different ids for User client and for Bot client.
     # Therefore we check identity by message text.
     with pytest.raises(AssertionError):
-        assert history[-1].json['message_id'] == message.id
-    assert history[-1].json['text'] == text
-    assert history[-1].json['text'] == message.text
+        assert payload['message_id'] == message.id
+    assert payload['text'] == text
+    assert payload['text'] == message.text
+
+
+async def test_args_middleware(tg_user: User, make_message):
+    async def handler(update: Update, message: Message, user: UserModel, bot: Bot | None):
+        ...
+
+    update = Update(1, message=make_message(tg_user, text='hey'))
+    context = SimpleNamespace(user=UserModel(tg=tg_user), bot=None)
+
+    args_middleware.prepare(handler)
+    kwargs = args_middleware.get_handler_kwargs(handler, update, context)  # type: ignore[arg-type]
+    assert kwargs == {'update': update, 'message': update.message, 'user': context.user, 'bot': None}
+
+    context.user = None
+    with pytest.raises(TypeError, match=r'Invalid handler argument type \(user\)'):
+        args_middleware.get_handler_kwargs(handler, update, context)  # type: ignore[arg-type]
+
+
+async def test_args_middleware_signature_missmatch():
+    async def handler(message: Message, unknown: int):
+        ...
+
+    with pytest.raises(ValueError, match=r'Invalid handler argument \(unknown: int\)'):
+        args_middleware.prepare(handler)
+
+
+async def test_handler_dependencies():
+    calls = []
+
+    def middleware_factory(dependency: Dependency):
+        @provides(dependency)
+        async def middleware(call_next: HandlerCallback, update: Update, context: SimpleNamespace):
+            calls.append(dependency)
+            return await call_next(update, context)
+
+        return middleware
+
+    async def handler(message: Message):
+        ...
+
+    app = LayeredApplication.builder().token('123:test').application_class(LayeredApplication).build()
+    app.add_middlewares([middleware_factory(dependency) for dependency in Dependency if dependency] + [args_middleware])
+
+    update = Update(1, message=Message(1, None, None))  # type: ignore[arg-type]
+    for requires, expected in [
+        (Dependency.NONE, []),
+        (Dependency.USER, [Dependency.SESSION, Dependency.USER]),
+        (Dependency.HISTORY, [Dependency.SESSION, Dependency.USER, Dependency.SERVICE, Dependency.HISTORY]),
+    ]:
+        calls.clear()
+        await app._handler_callback_factory(handler, requires)(update, SimpleNamespace())
+        assert calls == expected
+
+    # handler arguments assigned by not required middlewares are forbidden:
+    async def user_handler(message: Message, user: UserModel):
+        ...
+
+    with pytest.raises(ValueError, match=r'Invalid handler argument \(user\)'):
+        app._handler_callback_factory(user_handler, Dependency.SESSION)
+
+
+async def test_session_middleware(engine: AsyncEngine, setup_tables: None):
+    sent = []
+
+    async def reply(text: str):
+        # connection is returned to pool before outbound calls are sent:
+        sent.append((text, engine.pool.checkedout()))
+
+    async def handler(update: Update, context: SimpleNamespace):
+        await context.session.execute(select(1))
+        context.outbox.add(reply, 'first')
+        context.outbox.add(reply, text='second')
+        return 'done'
+
+    context = SimpleNamespace(application=SimpleNamespace(engine=engine))
+    assert await session_middleware(handler, Update(1), context) == 'done'  # type: ignore[arg-type]
+    assert sent == [('first', 0), ('second', 0)]
+
+    # outbound calls are dropped when nothing is committed:
+    async def failing_handler(update: Update, context: SimpleNamespace):
+        context.outbox.add(reply, 'never')
+        raise RuntimeError
+
+    with pytest.raises(RuntimeError):
+        await session_middleware(failing_handler, Update(1), context)  # type: ignore[arg-type]
+    assert len(sent) == 2
@@ -0,0 +1,68 @@
+from datetime import date, datetime
+
+import pytest
+from sqlalchemy import func, select, text
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession
+from telegram import User
+
+from database.models import (
+    MessageModel,
+    MessagePayloadModel,
+    UserModel,
+    insert_messages,
+)
+from database.partitions import create_message_partitions, detach_message_partitions
+
+pytestmark = pytest.mark.anyio
+
+
+async def count_rows(engine: AsyncEngine, table: str):
+    async with engine.connect() as connection:
+        return await connection.scalar(text(f'SELECT count(*) FROM {table}'))
+
+
+async def test_message_partitions(engine: AsyncEngine, setup_tables: None, tg_user: User, make_message):
+    async with AsyncSession(engine, expire_on_commit=False) as session, session.begin():
+        user = UserModel(tg=tg_user)
+        session.add(user)
+
+    rows = [
+        dict(
+            MessageModel.get_values(
+                make_message(tg_user, photo=photo).to_dict(), user_id=user.id, storage_id=user.storage_id, codec='jsonb'
+            ),
+            created_at=created_at,
+        )
+        for created_at in (datetime(2026, 6, 10), datetime(2026, 8, 10))
+        for photo in (True, False)
+    ]
+    async with engine.begin() as connection:
+        await insert_messages(connection, rows)
+
+    # history written before partitions are created is moved from default partition:
+    assert await count_rows(engine, 'message_default') == 4
+    created = await create_message_partitions(engine, months_ahead=2, today=date(2026, 6, 18))
+    assert created == ['message_y2026m06', 'message_y2026m07', 'message_y2026m08']
+    assert await create_message_partitions(engine, months_ahead=2, today=date(2026, 6, 18)) == []
+
+    assert await count_rows(engine, 'message_default') == 0
+    assert await count_rows(engine, 'message_y2026m06_media') == 1
+    assert await count_rows(engine, 'message_y2026m08_text') == 1
+
+    # old non-media history is detached and kept as archive:
+    assert await detach_message_partitions(engine, retention_months=1, today=date(2026, 8, 5)) == [
+        'message_y2026m06_text'
+    ]
+    assert await count_rows(engine, 'message') == 3
+    assert await count_rows(engine, 'message_y2026m06_text') == 1
+
+    # or dropped along with payloads:
+    detached = await detach_message_partitions(engine, retention_months=1, drop=True, today=date(2026, 10, 1))
+    assert detached == ['message_y2026m07_text', 'message_y2026m08_text']
+
+    async with AsyncSession(engine) as session:
+        assert (await session.scalar(select(func.count()).select_from(MessageModel))) == 2
+        assert (await session.scalar(select(func.count()).select_from(MessagePayloadModel))) == 3
+
+    async with engine.begin() as connection:
+        await connection.execute(text('DROP TABLE message_y2026m06_text'))
@@ -0,0 +1,66 @@
+import asyncio
+import time
+
+import pytest
+from telegram.error import RetryAfter
+
+from application.ratelimiter import OutboundRateLimiter, Priority
+
+pytestmark = pytest.mark.anyio
+
+
+class FakeBotAPI:
+    def __init__(self, *, flood: int = 0) -> None:
+        self.flood = flood
+        self.requests: list[tuple[float, str]] = []
+        self.started = time.monotonic()
+
+    async def __call__(self, text: str):
+        if self.flood:
+            self.flood -= 1
+            raise RetryAfter(0)
+        self.requests.append((time.monotonic() - self.started, text))
+        return True
+
+
+def send(limiter: OutboundRateLimiter, api: FakeBotAPI, chat_id: int | None, text: str, priority: Priority | None):
+    return limiter.process_request(api, (text,), {}, 'sendMessage', {'chat_id': chat_id, 'text': text}, priority)
+
+
+async def test_rate_limiter():
+    api = FakeBotAPI()
+    limiter = OutboundRateLimiter(rate=20, chat_rate=10, chat_burst=2, max_retries=1)
+
+    # chat burst is sent at once, then requests to the same chat are spread:
+    await asyncio.gather(*[send(limiter, api, 1, f'chat {i}', None) for i in range(4)])
+    assert [text for _, text in api.requests] == ['chat 0', 'chat 1', 'chat 2', 'chat 3']
+    assert api.requests[1][0] < 0.05
+    assert api.requests[3][0] >= 0.15
+
+    # when global limit is reached, interactive replies go ahead of broadcast queued before:
+    api.requests.clear()
+    broadcast = [send(limiter, api, chat_id, 'broadcast', Priority.BROADCAST) for chat_id in range(10, 50)]
+    tasks = [asyncio.create_task(request) for request in broadcast]
+    await asyncio.sleep(0.1)
+    assert limiter.queued[Priority.BROADCAST] > 0
+    sent = len(api.requests)
+    await send(limiter, api, 2, 'reply', None)
+
+    await asyncio.gather(*tasks)
+    assert [text for _, text in api.requests].index('reply') <= sent + 1
+    assert not limiter.queued
+    assert limiter.sent == 45
+
+    # requests failed by flood control are retried:
+    api.flood = 1
+    assert await send(limiter, api, 3, 'retried', None)
+    assert limiter.retries == 1
+
+    api.flood = 2
+    with pytest.raises(RetryAfter):
+        await send(limiter, api, 3, 'failed', None)
+
+    # requests not to chat are not limited:
+    await send(limiter, api, None, 'not limited', None)
+
+    await limiter.shutdown()
@@ -0,0 +1,109 @@
+import asyncio
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession
+from telegram import User
+
+from application.scheduler import JobScheduler
+from database.models import JobRunModel, SubscriptionModel, UserModel
+from service import AppService
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_job_scheduler(engine: AsyncEngine, setup_tables: None):
+    calls = []
+
+    async def job():
+        calls.append(job)
+
+    # the same job is scheduled by two application instances:
+    instances = [JobScheduler(engine, recovery_window=timedelta(days=1), lease=timedelta(hours=1)) for _ in range(2)]
+    for instance in instances:
+        instance.add_job(job, '0 3 * * *')
+
+    # run missed before start up is executed once:
+    now = datetime(2026, 10, 18, 12, 0)
+    executed = await asyncio.gather(*[instance.tick(now) for instance in instances])
+    assert sorted(executed) == [[], ['job']]
+    assert len(calls) == 1
+
+    # not due yet:
+    assert await instances[0].tick(now + timedelta(hours=12)) == []
+
+    # many missed runs are executed once, runs older than recovery window are not executed:
+    assert await instances[1].tick(now + timedelta(days=3)) == ['job']
+    assert await instances[0].tick(now + timedelta(days=3)) == []
+    assert len(calls) == 2
+
+    async with engine.connect() as connection:
+        runs = (await connection.execute(select(JobRunModel.scheduled_at, JobRunModel.finished_at))).all()
+        assert [(scheduled_at, bool(finished_at)) for scheduled_at, finished_at in runs] == [
+            (datetime(2026, 10, 21, 3, 0), True)
+        ]
+
+    # run not finished by stopped instance is executed again when its lease is expired:
+    async with engine.begin() as connection:
+        await connection.execute(update(JobRunModel).values(finished_at=None))
+
+    assert await instances[0].tick(now + timedelta(days=3, minutes=30)) == []
+    assert await instances[0].tick(now + timedelta(days=3, hours=2)) == ['job']
+    assert len(calls) == 3
+
+
+async def test_webhook_tick_jobs(monkeypatch: pytest.MonkeyPatch):
+    import webhook
+    from application import application
+
+    ticks = []
+
+    class FakeJobScheduler:
+        async def tick(self):
+            ticks.append(self)
+            return []
+
+    monkeypatch.setattr(application, 'get_job_scheduler', lambda app: FakeJobScheduler())
+    monkeypatch.setattr(webhook, 'get_app', lambda: None)
+    monkeypatch.setattr(webhook, '_jobs_ticked_at', None)
+
+    # jobs are ticked by invocations not more often than scheduler interval:
+    await webhook.tick_jobs()
+    await webhook.tick_jobs()
+    assert len(ticks) == 1
+
+
+async def test_webhook_tick_sends_subscriptions(
+    engine: AsyncEngine, setup_tables: None, tg_user: User, monkeypatch: pytest.MonkeyPatch
+):
+    import webhook
+    from application import application, tasks
+
+    async with AsyncSession(engine, expire_on_commit=False) as session, session.begin():
+        user = UserModel(tg=tg_user)
+        session.add(user)
+    async with AsyncSession(engine) as session, session.begin():
+        await AppService(session, user, None).subscribe()
+        await session.execute(update(SubscriptionModel).values(next_run_at=datetime.utcnow() - timedelta(minutes=1)))
+
+    sent = []
+
+    async def broadcast_feed_me(engine, bot, chat_ids: list[int], **kwargs):
+        sent.extend(chat_ids)
+        return tasks.BroadcastSummary(delivered=chat_ids)
+
+    async def maintain_history_partitions_task():
+        pass
+
+    app = SimpleNamespace(engine=engine, bot=None)
+    monkeypatch.setattr(application, 'get_app', lambda: app)
+    monkeypatch.setattr(application, 'maintain_history_partitions_task', maintain_history_partitions_task)
+    monkeypatch.setattr(tasks, 'broadcast_feed_me', broadcast_feed_me)
+    monkeypatch.setattr(webhook, 'get_app', lambda: app)
+    monkeypatch.setattr(webhook, '_jobs_ticked_at', None)
+
+    # due subscriptions are sent by webhook invocations as well:
+    await webhook.tick_jobs()
+    assert sent == [tg_user.id]
@@ -0,0 +1,339 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import delete, event, select, text
+from sqlalchemy.exc import InvalidRequestError
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession
+from telegram import User
+
+from accessories import MediaType
+from configurations import AppConfig
+from database import HistoryWriter, MembershipCache
+from database.models import (
+    MediaCounterModel,
+    MessageModel,
+    MessagePayloadModel,
+    StorageModel,
+    UserModel,
+)
+from exceptions import NoPhotosException
+from service import AppService
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_media_counter(session: AsyncSession, tg_user: User, make_message):
+    user = UserModel(tg=tg_user)
+    session.add(user)
+    service = AppService(session, user, None)
+
+    for _ in range(3):
+        service.append_history(make_message(tg_user, photo=True))
+    service.append_history(make_message(tg_user, text='not a media'))
+
+    assert await service.get_media_count() == 3
+    assert await service.get_media_count(media_type=MediaType.photo) == 3
+    assert await service.get_media_count(media_type=MediaType.video) == 0
+
+    counters = (await session.execute(select(MediaCounterModel))).scalars().all()
+    assert {(counter.storage_id, counter.media_type, counter.count) for counter in counters} == {
+        (tg_user.id, MediaType.photo.value, 3),
+        (tg_user.id, MediaType.video.value, 0),  # created by fallback
+    }
+
+    # fallback for storage without counters:
+    await session.execute(delete(MediaCounterModel))
+    assert await service.get_media_count() == 3
+
+
+async def test_history_count(session: AsyncSession, tg_user: User, make_message):
+    user = UserModel(tg=tg_user)
+    session.add(user)
+    service = AppService(session, user, None)
+
+    service.append_history(make_message(tg_user, photo=True, media_group_id='group'))
+    service.append_history(make_message(tg_user, photo=True, media_group_id='group'))
+    service.append_history(make_message(tg_user, photo=True))
+
+    assert await service.get_history_count() == 3
+    assert await service.get_history_count(MessageModel.media_group_id == 'group') == 2
+
+
+async def test_message_payload(session: AsyncSession, tg_user: User, make_message):
+    user = UserModel(tg=tg_user)
+    session.add(user)
+    service = AppService(session, user, None)
+
+    message = make_message(tg_user, photo=True)
+    instance = service.append_history(message)
+    await session.flush()
+
+    # payload is not loaded implicitly:
+    session.expire(instance)
+    instance = (await session.execute(select(MessageModel))).scalar_one()
+    with pytest.raises(InvalidRequestError):
+        instance.payload
+    await session.refresh(instance, ['payload'])
+    assert instance.payload.data == message.to_dict()
+
+    # compressed payload:
+    values = MessagePayloadModel.get_values(message.to_dict(), codec='zlib')
+    assert values['json'] is None
+    assert MessagePayloadModel(**values).data == message.to_dict()
+
+
+async def test_media_sampling(engine: AsyncEngine, session: AsyncSession, tg_user: User, make_message):
+    user = UserModel(tg=tg_user)
+    session.add(user)
+    service = AppService(session, user, None)
+
+    with pytest.raises(NoPhotosException):
+        await service.get_media_id()
+
+    messages = [make_message(tg_user, photo=True) for _ in range(3)]
+    media_ids = {service.append_history(message).media_id for message in messages}
+    service.append_history(make_message(tg_user, text='not a media'))
+
+    taken = {await service.get_media_id() for _ in range(50)}
+    assert taken == media_ids
+
+    positions = (await session.execute(select(MessageModel.media_seq).filter(MessageModel.media_id.isnot(None)))).all()
+    assert sorted(positions) == [(0,), (1,), (2,)]
+
+    # position lookup is an index scan of media partitions only:
+    query = service._get_media_position_query(MediaType.photo.value, 0)
+    sql = str(query.compile(engine, compile_kwargs={'literal_binds': True}))
+    await session.execute(text('SET LOCAL enable_seqscan = off'))
+    plan = '\n'.join((await session.execute(text(f'EXPLAIN {sql}'))).scalars())
+    assert 'message.media_id IS NOT NULL' in sql
+    assert 'storage_id_media_type_media_seq_idx' in plan
+    assert 'Seq Scan' not in plan
+
+
+async def test_media_index_rebuilding(session: AsyncSession, tg_users: list[User], make_message):
+    vybornyy, herzog = UserModel(tg=tg_users[0]), UserModel(tg=tg_users[1])
+    session.add_all([vybornyy, herzog])
+    for user in vybornyy, herzog:
+        service = AppService(session, user, None)
+        service.append_history(make_message(user.tg, photo=True))
+        service.append_history(make_message(user.tg, photo=True))
+    await session.flush()
+
+    # herzog joins vybornyy storage along with his media:
+    herzog.storage_id = vybornyy.storage_id
+    await AppService(session, vybornyy, None).move_history(herzog.id, herzog.id, vybornyy.storage_id)
+
+    assert await AppService(session, vybornyy, None).get_media_count() == 4
+    assert await AppService(session, herzog, None).get_media_count() == 4
+    query = select(MessageModel.media_seq).order_by(MessageModel.media_seq)
+    assert (await session.execute(query)).scalars().all() == [0, 1, 2, 3]
+
+
+async def test_history_writer(engine: AsyncEngine, setup_tables: None, tg_user: User, make_message):
+    async with AsyncSession(engine, expire_on_commit=False) as session, session.begin():
+        user = UserModel(tg=tg_user)
+        session.add(user)
+
+    writer = HistoryWriter(engine, batch_size=2, flush_interval=60, max_pending=3)
+
+    async with AsyncSession(engine) as session, session.begin():
+        service = AppService(session, user, None, writer)
+        for _ in range(3):
+            await service.record_history(make_message(tg_user, photo=True, media_group_id='group'))
+
+        # rows are queued when transaction is committed, they are counted as history meanwhile:
+        assert writer.pending(lambda row: True) == 0
+        assert writer.pending(lambda row: True, session=session) == 3
+        assert await service.get_media_count() == 3
+        assert await service.get_media_group_count('group') == 3
+
+        # backpressure: waiting for free space while buffer is full
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(service.record_history(make_message(tg_user, text='hey')), 0.1)
+
+    # full batch is written by started writer:
+    writer.start()
+    await asyncio.sleep(0.1)
+    assert writer.pending(lambda row: True) == 0
+
+    async with AsyncSession(engine) as session, session.begin():
+        service = AppService(session, user, None, writer)
+        assert await service.get_media_count() == 3
+        assert await service.get_media_group_count('group') == 3
+
+        await service.record_history(make_message(tg_user, text='hey'))
+
+    # rows of rolled back transaction are dropped:
+    with pytest.raises(RuntimeError):
+        async with AsyncSession(engine) as session, session.begin():
+            await AppService(session, user, None, writer).record_history(make_message(tg_user, text='rolled back'))
+            raise RuntimeError
+    assert writer.pending(lambda row: True) == 1
+    assert writer._slots._value == 2
+
+    # rows rejected by database (unknown user) are dropped, so they do not block the others:
+    await writer.put(
+        MessageModel.get_values(make_message(tg_user).to_dict(), user_id=404, storage_id=404, codec='jsonb')
+    )
+
+    # all queued rows are written at stop:
+    await writer.stop()
+    assert writer.pending(lambda row: True) == 0
+    async with AsyncSession(engine) as session:
+        history = (await session.execute(select(MessageModel))).scalars().all()
+        assert len(history) == 4
+        assert sorted(message.media_seq for message in history if message.media_id) == [0, 1, 2]
+
+
+async def test_history_writer_retries(engine: AsyncEngine):
+    writer = HistoryWriter(engine, batch_size=2, flush_interval=0.01, max_pending=3, max_retries=2)
+    attempts = []
+
+    async def write(batch: list[dict]):
+        attempts.append(batch)
+        raise ConnectionError('database is down')
+
+    writer._write = write  # type: ignore[method-assign]
+    await writer.put({'id': 1})
+
+    # failed batch is retried up to max retries, then rows are kept until the next flush:
+    await asyncio.wait_for(writer.flush(), 1)
+    assert len(attempts) == 3
+    assert writer.pending(lambda row: True) == 1
+
+    # rows are dropped at stop after bounded retries:
+    await asyncio.wait_for(writer.stop(retries=1), 1)
+    assert len(attempts) == 5
+
+
+async def test_membership_cache(engine: AsyncEngine, setup_tables: None, tg_users: list[User]):
+    owner, participant, other = tg_users
+    async with AsyncSession(engine) as session, session.begin():
+        session.add_all([UserModel(tg=tg) for tg in tg_users])
+
+    statements = []
+
+    def collect_statement(connection, cursor, statement, *args):
+        statements.append(statement)
+
+    event.listen(engine.sync_engine, 'before_cursor_execute', collect_statement)
+    cache = MembershipCache(maxsize=2, ttl=60)
+
+    async with AsyncSession(engine) as session, session.begin():
+        user = await AppService(session, None, None, cache=cache).get_user(participant)
+        user.storage_request = await session.get(StorageModel, owner.id)
+    assert (cache.hits, cache.misses) == (0, 1)
+
+    # snapshot is not affected by changes made after it was taken and is not bound to any session:
+    statements.clear()
+    async with AsyncSession(engine) as session, session.begin():
+        service = AppService(session, None, None, cache=cache)
+        user = await service.get_user(participant)
+        assert user in session
+        assert user.tg is participant
+        assert user.storage_request_id is None
+        assert user.storage.requests == []
+        assert not statements  # taken without queries
+
+        service.invalidate_membership(user_ids=(participant.id,))
+
+    async with AsyncSession(engine) as session, session.begin():
+        user = await AppService(session, None, None, cache=cache).get_user(participant.id)
+        assert user.storage_request_id == owner.id
+    assert (cache.hits, cache.misses) == (1, 2)
+
+    # users of storage are invalidated:
+    async with AsyncSession(engine) as session, session.begin():
+        service = AppService(session, None, None, cache=cache)
+        assert (await service.get_user(owner)).storage.requests[0].id == participant.id
+        service.invalidate_membership(storage_ids=(owner.id,))
+    assert len(cache) == 0
+
+    # least recently used users are evicted:
+    async with AsyncSession(engine) as session:
+        service = AppService(session, None, None, cache=cache)
+        for tg in (owner, participant, other, owner):
+            await service.get_user(tg)
+    assert len(cache) == 2
+    assert cache.get(participant.id) is None
+
+    event.remove(engine.sync_engine, 'before_cursor_execute', collect_statement)
+
+
+async def test_get_or_create_user(engine: AsyncEngine, setup_tables: None, tg_users: list[User]):
+    owner, participant, other = tg_users
+    statements = []
+
+    def collect_statement(connection, cursor, statement, *args):
+        statements.append(statement)
+
+    event.listen(engine.sync_engine, 'before_cursor_execute', collect_statement)
+
+    # new user is created along with default storage by a single statement:
+    async with AsyncSession(engine) as session, session.begin():
+        user = await AppService(session, None, None).get_or_create_user(owner)
+        assert (user.id, user.storage_id, user.storage.id) == (owner.id, owner.id, owner.id)
+        assert user.storage.requests == []
+        assert user.tg is owner
+    assert len([statement for statement in statements if 'INSERT' in statement]) == 1
+
+    async with AsyncSession(engine) as session, session.begin():
+        requested = await AppService(session, None, None).get_or_create_user(participant)
+        requested.storage_request = await session.get(StorageModel, owner.id)
+
+    # existing user is loaded with storage requests by a single statement:
+    statements.clear()
+    async with AsyncSession(engine) as session, session.begin():
+        user = await AppService(session, None, None).get_or_create_user(owner)
+        assert [request.id for request in user.storage.requests] == [participant.id]
+    assert len(statements) == 1
+
+    event.remove(engine.sync_engine, 'before_cursor_execute', collect_statement)
+
+    # concurrent first messages: user inserted by another transaction is taken once it is committed
+    async with AsyncSession(engine) as first, AsyncSession(engine) as second:
+        async with first.begin():
+            await AppService(first, None, None).get_or_create_user(other)
+            task = asyncio.create_task(AppService(second, None, None).get_or_create_user(other))
+            await asyncio.sleep(0.2)  # wait for task to be blocked by not committed insert
+            assert not task.done()
+
+        user = await task
+        assert user.id == other.id
+        await second.commit()
+
+
+async def test_subscriptions(engine: AsyncEngine, setup_tables: None, tg_users: list[User], config: AppConfig):
+    owner, participant, _ = tg_users
+    async with AsyncSession(engine, expire_on_commit=False) as session, session.begin():
+        users = [UserModel(tg=tg) for tg in (owner, participant)]
+        session.add_all(users)
+
+    async with AsyncSession(engine, expire_on_commit=False) as session, session.begin():
+        with pytest.raises(KeyError):
+            await AppService(session, users[0], None).subscribe('Nowhere/Unknown')
+
+        subscription = await AppService(session, users[0], None).subscribe('Europe/Moscow')
+        await AppService(session, users[1], None).subscribe()
+
+    # schedule is at user time zone, minute and hours are taken by user id:
+    assert subscription.cron == f'{owner.id % 60} 9,14,19 * * *'
+    assert config.get_feed_me_cron(60 * 3 + 7) == '7 12,17,22 * * *'
+    assert config.get_feed_me_cron(60 * 5 + 7) == '7 9,14,19 * * *'
+    subscription.schedule(datetime(2026, 10, 18, 12, 0))
+    assert subscription.next_run_at == datetime(2026, 10, 18, 16, owner.id % 60)
+
+    # due subscriptions are taken and rescheduled, locked ones are skipped by concurrent schedulers:
+    now = datetime.utcnow() + timedelta(days=1)
+    async with AsyncSession(engine) as first, AsyncSession(engine) as second:
+        async with first.begin():
+            claimed = await AppService(first, None, None).claim_due_subscriptions(limit=1, now=now)
+            async with second.begin():
+                claimed += await AppService(second, None, None).claim_due_subscriptions(limit=10, now=now)
+    assert sorted(claimed) == [owner.id, participant.id]
+
+    async with AsyncSession(engine) as session, session.begin():
+        assert await AppService(session, None, None).claim_due_subscriptions(limit=10, now=now) == []
+        assert await AppService(session, users[0], None).unsubscribe()
+        assert not await AppService(session, users[0], None).unsubscribe()
@@ -0,0 +1,61 @@
+import pytest
+from sqlalchemy import delete
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession
+from telegram import User
+from telegram.error import Forbidden
+
+from application.tasks import broadcast_feed_me
+from database.models import (
+    MediaCounterModel,
+    MessageModel,
+    UserModel,
+    insert_messages,
+)
+
+pytestmark = pytest.mark.anyio
+
+
+class FakeBot:
+    def __init__(self, blocked: set[int]) -> None:
+        self.blocked = blocked
+        self.sent: dict[int, str] = {}
+
+    async def send_photo(self, chat_id: int, photo: str, caption: str, **kwargs):
+        if chat_id in self.blocked:
+            raise Forbidden('Forbidden: bot was blocked by the user')
+        self.sent[chat_id] = photo
+
+
+async def test_broadcast_feed_me(engine: AsyncEngine, setup_tables: None, tg_users: list[User], make_message):
+    owner, participant, other = tg_users
+    async with AsyncSession(engine, expire_on_commit=False) as session, session.begin():
+        users = {tg.id: UserModel(tg=tg) for tg in tg_users}
+        session.add_all(users.values())
+
+    rows = [
+        MessageModel.get_values(
+            make_message(tg, photo=True).to_dict(), user_id=tg.id, storage_id=users[tg.id].storage_id, codec='jsonb'
+        )
+        for tg in (owner, owner, participant)
+    ]
+    async with engine.begin() as connection:
+        await insert_messages(connection, rows)
+
+    # chats without user or media are skipped, failed chat does not affect others:
+    bot = FakeBot(blocked={participant.id})
+    summary = await broadcast_feed_me(
+        engine, bot, [owner.id, participant.id, other.id, 404], concurrency=2  # type: ignore[arg-type]
+    )
+    assert summary.delivered == [owner.id]
+    assert summary.failed == [participant.id]
+    assert summary.skipped == [other.id, 404]
+    assert bot.sent[owner.id] in {row['media_id'] for row in rows if row['user_id'] == owner.id}
+
+    # storages without counters are handled as well:
+    async with engine.begin() as connection:
+        await connection.execute(delete(MediaCounterModel).filter_by(storage_id=participant.id))
+
+    bot = FakeBot(blocked=set())
+    summary = await broadcast_feed_me(engine, bot, [owner.id, participant.id], concurrency=2)  # type: ignore[arg-type]
+    assert sorted(summary.delivered) == [owner.id, participant.id]
+    assert bot.sent[participant.id] == rows[2]['media_id']